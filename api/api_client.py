@@ -1,10 +1,16 @@
 import hashlib
+import logging
 import os
 import random
 import time
+from contextlib import nullcontext
+from typing import Iterator, List, Tuple
+from urllib.parse import urlsplit
 
 import requests
 
+from .models import FileResource, Video
+
 # import cloudscraper
 # from requests_html import HTMLSession
 # from bs4 import BeautifulSoup
@@ -13,6 +19,8 @@ import requests
 api_url = 'https://api.iwara.tv'
 file_url = 'https://files.iwara.tv'
 
+logger = logging.getLogger(__name__)
+
 class BearerAuth(requests.auth.AuthBase):
     """Bearer Authentication"""
     def __init__(self, token):
@@ -23,9 +31,10 @@ class BearerAuth(requests.auth.AuthBase):
         return r
 
 class ApiClient:
-    def __init__(self, email, password):
+    def __init__(self, email, password, governor=None):
         self.email = email
         self.password = password
+        self.governor = governor  # BandwidthGovernor, None for unlimited
         self.session = requests.Session()
         self.session = requests.Session()
         self.session.headers.update({
@@ -34,6 +43,7 @@ class ApiClient:
         })  # 设置请求头,启用HTTP持久连接
         self.request_delay = (5, 10)  # 设置请求间隔时间范围(秒)
         self.video_cache = {}  # 创建一个字典用于缓存视频数据
+        self.on_wait = None  # 限速等待回调, 参数为等待秒数
         # self.headers = {
         # 'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36',
         # 'X-Version': 's'
@@ -60,12 +70,13 @@ class ApiClient:
     def login(self) -> requests.Response:
         url = self.api_url + '/user/login'
         json = {'email': self.email, 'password': self.password}
-        r = requests.post(url, json=json, timeout=self.timeout)
+        with self._interactive():
+            r = requests.post(url, json=json, timeout=self.timeout)
         try:
             self.token = r.json()['token']
-            print('API Login success')
+            logger.info('API Login success')
         except:
-            print('API Login failed')
+            logger.error('API Login failed')
 
         # try:
         #     # Cloudscraper
@@ -78,8 +89,17 @@ class ApiClient:
 
         return r
     def _make_request(self, method, url, **kwargs):
-        time.sleep(random.uniform(*self.request_delay))  # 在发送请求前添加随机延时
-        return self.session.request(method, url, **kwargs)
+        delay = random.uniform(*self.request_delay)  # 在发送请求前添加随机延时
+        if self.on_wait is not None:
+            self.on_wait(delay)
+        time.sleep(delay)
+        with self._interactive():
+            return self.session.request(method, url, **kwargs)
+
+    def _interactive(self):
+        """# Give small API requests priority over bulk transfers
+        """
+        return self.governor.interactive() if self.governor is not None else nullcontext()
     
     # limit query is not working
     def get_videos(self, sort = 'date', rating = 'all', page = 0, limit = 32, subscribed = False) -> requests.Response:
@@ -95,7 +115,8 @@ class ApiClient:
                   'subscribed': 'true' if subscribed else 'false',
                   }
         if self.token is None:
-            r = requests.get(url, params=params, timeout=self.timeout)
+            with self._interactive():
+                r = requests.get(url, params=params, timeout=self.timeout)
         else:
 
             # Verbose Debug
@@ -103,16 +124,25 @@ class ApiClient:
             # print(request.prepare().method, request.prepare().url, request.prepare().headers, request.prepare().body, sep='\n')
             # r = requests.Session().send(request.prepare())
 
-            r = requests.get(url, params=params, auth=BearerAuth(self.token), timeout=self.timeout)
+            with self._interactive():
+                r = requests.get(url, params=params, auth=BearerAuth(self.token), timeout=self.timeout)
 
-        #Debug
-        print("[DEBUG] get_videos response:", r)
+        logger.debug("get_videos response: %s", r)
 
         return r
+
+    def iter_videos(self, sort = 'date', rating = 'all', page = 0, limit = 32, subscribed = False) -> Iterator[Video]:
+        """# Fetch one page of get_videos and iterate over it as Video objects
+        The request is made immediately, entries are converted as they are consumed.
+        """
+        r = self.get_videos(sort=sort, rating=rating, page=page, limit=limit, subscribed=subscribed)
+        r.raise_for_status()
+
+        return (Video.from_json(data) for data in r.json()['results'])
     
-    def get_video(self, video_id) -> requests.Response:
+    def get_video(self, video_id) -> Video:
         if video_id in self.video_cache:
-            print(f"Video {video_id} found in cache, using cached data.")
+            logger.debug(f"Video {video_id} found in cache, using cached data.")
             return self.video_cache[video_id]
         
         url = self.api_url + '/video/' + video_id
@@ -122,34 +152,101 @@ class ApiClient:
         else:
             r = self._make_request('GET', url, auth=BearerAuth(self.token), timeout=self.timeout)
 
-        self.video_cache[video_id] = r  # 将请求结果存入缓存
-        return r
+        r.raise_for_status()
+        video = Video.from_json(r.json())
+
+        self.video_cache[video_id] = video  # 将解析结果存入缓存
+        return video
+
+    def get_resources(self, video) -> List[FileResource]:
+        """# Get the downloadable qualities of a video
+        """
+        url = video.file_url
+        expires = url.split('/')[4].split('?')[1].split('&')[0].split('=')[1]
+
+        # IMPORTANT: This might change in the future.
+        SHA_postfix = "_5nFp9kmbNnHdAFhaqMvt"
+
+        SHA_key = video.file_id + "_" + expires + SHA_postfix
+        hash = hashlib.sha1(SHA_key.encode('utf-8')).hexdigest()
+
+        headers = {"X-Version": hash}
+
+        with self._interactive():
+            r = requests.get(url, headers=headers, auth=BearerAuth(self.token), timeout=self.timeout)
+        r.raise_for_status()
+
+        resources = [FileResource.from_json(resource) for resource in r.json()]
+
+        logger.debug("Video %s resources: %s", video.id, resources)
+
+        return resources
     
     def download_video_thumbnail(self, video_id) -> str:
         """# Download video thumbnail from iwara.tv
         """
-        video = self.get_video(video_id).json()
-
-        file_id = video['file']['id']
-        thumbnail_id = video['thumbnail']
+        video = self.get_video(video_id)
         
-        url = self.file_url + '/image/original/' + file_id + '/thumbnail-{:02d}.jpg'.format(thumbnail_id)
+        url = self.file_url + '/image/original/' + video.file_id + '/thumbnail-{:02d}.jpg'.format(video.thumbnail)
 
         thumbnail_file_name = video_id + '.jpg'
 
         if (os.path.exists(thumbnail_file_name)):
-            print(f"Video ID {video_id} thumbnail already downloaded, skipped downloading. ")
+            logger.info(f"Video ID {video_id} thumbnail already downloaded, skipped downloading. ")
             return thumbnail_file_name
         
-        print(f"Downloading thumbnail for video ID: {video_id} ...")
-        with open(thumbnail_file_name, "wb") as f:
-            for chunk in requests.get(url).iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    f.flush()
+        logger.info(f"Downloading thumbnail for video ID: {video_id} ...")
+        self._download_resumable(url, thumbnail_file_name)
 
         return thumbnail_file_name
 
+    def _download_resumable(self, url, file_name, chunk_size=256 * 1024):
+        """# Download url to file_name through a .part file
+        An interrupted download is continued with a Range request, and
+        file_name only appears once the download is complete.
+        """
+        part_file_name = file_name + '.part'
+
+        while True:
+            offset = os.path.getsize(part_file_name) if os.path.exists(part_file_name) else 0
+
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else {}
+
+            with requests.get(url, headers=headers, stream=True, timeout=self.download_timeout) as r:
+                if r.status_code == 416:
+                    if offset == 0:
+                        # 没有发送 Range, 416 只能是服务器错误
+                        r.raise_for_status()
+
+                    # Content-Range: bytes */<文件总大小>
+                    total = r.headers.get('Content-Range', '').rpartition('/')[2]
+                    if total == str(offset):
+                        # .part 已是完整文件
+                        break
+
+                    logger.warning(f"{part_file_name} does not match the remote file ({offset} / {total or '?'} bytes), restarting")
+                    os.remove(part_file_name)
+                    continue
+
+                r.raise_for_status()
+
+                if offset > 0 and r.status_code == 206:
+                    logger.info(f"Resuming {file_name} from byte {offset}")
+                    mode = "ab"
+                else:
+                    mode = "wb"
+
+                with open(part_file_name, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            if self.governor is not None:
+                                self.governor.throttle("download", len(chunk))
+                            f.write(chunk)
+
+                break
+
+        os.replace(part_file_name, file_name)
+
     def download_video(self, video_id) -> str:
         """# Download video from iwara.tv
         """
@@ -170,71 +267,67 @@ class ApiClient:
 
         # API
         try:
-            video = self.get_video(video_id).json()
+            video = self.get_video(video_id)
         except Exception as e:
-            raise Exception(f"Failed to get video info for video ID: {video_id}, error: {e}")
-
-        #Debug
-        print(video)
+            raise Exception(f"Failed to get video info for video ID: {video_id}, error: {e}") from e
 
-        url = video['fileUrl']
-        file_id = video['file']['id']
-        expires = url.split('/')[4].split('?')[1].split('&')[0].split('=')[1]
+        logger.debug("Video %s: %s", video_id, video)
 
-        # IMPORTANT: This might change in the future.
-        SHA_postfix = "_5nFp9kmbNnHdAFhaqMvt"
-
-        SHA_key = file_id + "_" + expires + SHA_postfix
-        hash = hashlib.sha1(SHA_key.encode('utf-8')).hexdigest()
-
-        headers = {"X-Version": hash}
-
-        resources = requests.get(url, headers=headers, auth=BearerAuth(self.token), timeout=self.timeout).json()
-        
-        #Debug
-        print(resources)
+        resources = self.get_resources(video)
 
         resources_by_quality = [None for i in range(10)]
 
         for resource in resources:
-            if resource['name'] == 'Source':
+            if resource.name == 'Source':
                 resources_by_quality[0] = resource
-            # elif resource['name'] == '1080':
+            # elif resource.name == '1080':
             #     resources_by_quality[1] = resource
-            # elif resource['name'] == '720':
+            # elif resource.name == '720':
             #     resources_by_quality[2] = resource
-            # elif resource['name'] == '480':
+            # elif resource.name == '480':
             #     resources_by_quality[3] = resource
-            # elif resource['name'] == '540':
+            # elif resource.name == '540':
                 # resources_by_quality[4] = resource
-            # elif resource['name'] == '360':
+            # elif resource.name == '360':
                 # resources_by_quality[5] = resource
 
         for resource in resources_by_quality:
             if resource is not None:
-                #Debug
-                print(resource)
+                logger.debug("Video %s selected resource: %s", video_id, resource)
 
-                download_link = "https:" + resource['src']['download']
-                file_type = resource['type'].split('/')[1]
+                download_link = urlsplit(self.file_url).scheme + ":" + resource.download
+                file_type = resource.file_type
 
                 video_file_name = video_id + '.' + file_type
 
                 if (os.path.exists(video_file_name)):
-                    print(f"Video ID {video_id} Already downloaded, skipped downloading. ")
+                    logger.info(f"Video ID {video_id} Already downloaded, skipped downloading. ")
                     return video_file_name
 
-                print(f"Downloading video ID: {video_id} ...")
+                logger.info(f"Downloading video ID: {video_id} ...")
                 try:
-                    with open(video_file_name, "wb") as f:
-                        for chunk in requests.get(download_link).iter_content(chunk_size=1024):
-                            if chunk:
-                                f.write(chunk)
-                                f.flush()
+                    self._download_resumable(download_link, video_file_name)
                     return video_file_name
                 except Exception as e:
-                    os.remove(video_file_name)
-                    raise Exception(f"Failed to download video ID: {video_id}, error: {e}")
+                    # 保留 .part 文件, 下次从断点继续下载
+                    raise Exception(f"Failed to download video ID: {video_id}, error: {e}") from e
 
             
-        raise Exception("No video with Source quality found")
\ No newline at end of file
+        raise Exception("No video with Source quality found")
+
+    def open_video_stream(self, video_id) -> Tuple[requests.Response, str]:
+        """# Open the Source quality of a video as a streaming response
+        Returns (response, file_type). The caller reads and closes the response.
+        """
+        video = self.get_video(video_id)
+
+        for resource in self.get_resources(video):
+            if resource.name == 'Source':
+                download_link = urlsplit(self.file_url).scheme + ":" + resource.download
+
+                r = requests.get(download_link, stream=True, timeout=self.download_timeout)
+                r.raise_for_status()
+
+                return (r, resource.file_type)
+
+        raise Exception("No video with Source quality found")
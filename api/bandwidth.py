@@ -0,0 +1,333 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Longest single sleep, so that reconfiguration takes effect quickly
+MAX_SLEEP = 0.5
+
+# Largest block of tokens a process reserves from the shared buckets at once
+RESERVE_BLOCK = 1024 * 1024
+
+# Seconds the host-wide interactive request count is cached
+INTERACTIVE_CACHE = 0.1
+
+
+class TokenBucket:
+    """# Byte-rate limiter
+    - rate: bytes per second, None for unlimited
+    - burst: bucket size in bytes, defaults to one second of rate
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.rate = None
+        self.burst = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate=None, burst=None):
+        with self.lock:
+            self.rate = float(rate) if rate else None
+            self.burst = float(burst) if burst else self.rate
+            if self.burst is not None:
+                self.tokens = min(self.tokens, self.burst)
+            self.updated = time.monotonic()
+
+    def consume(self, n, rate_cap=None) -> float:
+        """# Take n bytes worth of tokens, sleeping until they are available
+        - rate_cap: temporarily refill no faster than this
+        Returns the seconds spent waiting.
+        """
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                rate = self.rate
+                if rate_cap is not None:
+                    rate = rate_cap if rate is None else min(rate, rate_cap)
+
+                if rate is None:
+                    return waited
+
+                burst = self.burst or rate
+                now = time.monotonic()
+                self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+
+                # 超过 burst 的请求先透支, 由之后的请求补回
+                need = min(n, burst)
+                if self.tokens >= need:
+                    self.tokens -= n
+                    return waited
+
+                delay = min((need - self.tokens) / rate, MAX_SLEEP)
+
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedBandwidthState:
+    """# Token buckets and in-flight interactive requests shared by processes
+
+    Kept in a small SQLite file so that every bot process on the host (e.g.
+    several queue workers) draws from the same budgets and sees each
+    other's interactive requests. Rates themselves are not stored: every
+    process reads them from the same config.json.
+    """
+
+    def __init__(self, path="IwaraBandwidth.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+        self.interactive_cache = (0, float("-inf"))  # (count, monotonic time of the query)
+        self.init_DB()
+
+    def connect_DB(self):
+        """# One connection per process, reopened after a fork
+        Callers hold self.lock.
+        """
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=OFF")  # 令牌数丢失无关紧要
+            self.pid = os.getpid()
+        return self.conn.cursor()
+
+    def init_DB(self):
+        with self.lock:
+            c = self.connect_DB()
+
+            c.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL,
+                updated REAL
+            )""")
+            c.execute("""CREATE TABLE IF NOT EXISTS interactive (
+                pid INTEGER PRIMARY KEY,
+                count INTEGER
+            )""")
+
+    def consume(self, buckets, n) -> float:
+        """# Take n bytes from every bucket at once, sleeping until all have them
+        - buckets: [(name, rate, burst)], rate None for unlimited
+        Returns the seconds spent waiting.
+        """
+        buckets = [(name, rate, burst or rate) for (name, rate, burst) in buckets if rate is not None]
+        waited = 0.0
+
+        if not buckets:
+            return waited
+
+        while True:
+            with self.lock:
+                c = self.connect_DB()
+                try:
+                    c.execute("BEGIN IMMEDIATE")
+                    # 多进程共享, 只能用墙上时间
+                    now = time.time()
+                    delay = 0.0
+                    tokens = {}
+
+                    for (name, rate, burst) in buckets:
+                        c.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,))
+                        (current, updated) = c.fetchone() or (0.0, now)
+                        tokens[name] = min(burst, current + max(0.0, now - updated) * rate)
+
+                        # 超过 burst 的请求先透支, 由之后的请求补回
+                        need = min(n, burst)
+                        if tokens[name] < need:
+                            delay = max(delay, min((need - tokens[name]) / rate, MAX_SLEEP))
+
+                    if delay == 0:
+                        for name in tokens:
+                            tokens[name] -= n
+
+                    c.executemany("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                  [(name, value, now) for (name, value) in tokens.items()])
+                    c.execute("COMMIT")
+                except Exception:
+                    c.execute("ROLLBACK")
+                    raise
+
+            if delay == 0:
+                return waited
+
+            time.sleep(delay)
+            waited += delay
+
+    def set_interactive(self, count):
+        """# Publish the number of interactive requests this process has in flight
+        """
+        with self.lock:
+            c = self.connect_DB()
+
+            if count > 0:
+                c.execute("INSERT OR REPLACE INTO interactive (pid, count) VALUES (?, ?)", (os.getpid(), count))
+            else:
+                c.execute("DELETE FROM interactive WHERE pid = ?", (os.getpid(),))
+
+    def interactive_count(self, max_age=INTERACTIVE_CACHE) -> int:
+        """# Interactive requests in flight on the host, at most max_age seconds old
+        """
+        with self.lock:
+            (count, checked) = self.interactive_cache
+            if time.monotonic() - checked < max_age:
+                return count
+
+            c = self.connect_DB()
+            c.execute("SELECT pid, count FROM interactive")
+            rows = c.fetchall()
+
+            # 进程被杀死时不会清除自己的记录
+            dead = [(pid,) for (pid, _) in rows if not _pid_alive(pid)]
+            if dead:
+                c.executemany("DELETE FROM interactive WHERE pid = ?", dead)
+
+            count = sum(count for (pid, count) in rows if (pid,) not in dead)
+            self.interactive_cache = (count, time.monotonic())
+
+            return count
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class BandwidthGovernor:
+    """# Shared bandwidth budget for downloads and uploads
+
+    - ingress / egress: total inbound / outbound bytes per second
+    - download / upload: budget of bulk file transfers in each direction
+    - yield_rate: while an interactive request (listing, metadata, login) is
+      in flight, bulk transfers are slowed to this many bytes per second
+      so the small request is not starved into a timeout
+
+    All rates are bytes per second, None for unlimited, and can be changed
+    at any time with configure().
+
+    - path: SharedBandwidthState file, so that all processes on the host
+      share the budgets and yield to each other's interactive requests.
+      None keeps the budgets inside this process. Tokens are reserved from
+      the file in blocks of up to RESERVE_BLOCK (a quarter of the smallest
+      burst for low rates) and handed out within the process.
+    """
+
+    DIRECTIONS = {"download": "ingress", "upload": "egress"}
+
+    def __init__(self, ingress=None, egress=None, download=None, upload=None, yield_rate=None, path=None):
+        self.buckets = {
+            "ingress": TokenBucket(),
+            "egress": TokenBucket(),
+            "download": TokenBucket(),
+            "upload": TokenBucket(),
+        }
+        self.yield_rate = None
+        self.interactive_count = 0
+        self.lock = threading.Lock()
+        self.on_wait = None  # 限速等待回调, 参数为方向和等待秒数
+        self.shared = SharedBandwidthState(path) if path is not None else None
+        self.allowance = {"download": 0.0, "upload": 0.0}  # 已从共享令牌桶预留, 尚未使用的字节数
+        self.reserve_lock = threading.Lock()
+        self.configure(ingress=ingress, egress=egress, download=download, upload=upload, yield_rate=yield_rate)
+
+    @classmethod
+    def from_config(cls, config) -> "BandwidthGovernor":
+        options = dict(config.get("bandwidth", {}))
+        # 默认与同一主机上的其它进程共享预算
+        options.setdefault("path", "IwaraBandwidth.db")
+        return cls(**options)
+
+    def configure(self, **rates):
+        """# Change rates live, e.g. configure(download=10 * 1024 * 1024)
+        """
+        for (name, rate) in rates.items():
+            if name == "path":
+                # 共享状态文件只在创建时打开
+                continue
+            elif name == "yield_rate":
+                self.yield_rate = float(rate) if rate else None
+            elif name in self.buckets:
+                self.buckets[name].set_rate(rate)
+            else:
+                raise ValueError("Unknown bandwidth budget: {}".format(name))
+
+    @contextmanager
+    def interactive(self):
+        """# Mark a small, latency-sensitive request as in flight
+        """
+        # 只有配置了 yield_rate 时其它进程才会读取, 否则不写共享文件
+        published = self.shared is not None and self.yield_rate is not None
+
+        with self.lock:
+            self.interactive_count += 1
+            if published:
+                self.shared.set_interactive(self.interactive_count)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.interactive_count -= 1
+                if published:
+                    self.shared.set_interactive(self.interactive_count)
+
+    def interactive_active(self) -> bool:
+        """# Whether bulk transfers should yield right now
+        """
+        if self.yield_rate is None:
+            return False
+        if self.interactive_count > 0:
+            return True
+        return self.shared is not None and self.shared.interactive_count() > 0
+
+    def throttle(self, direction, n) -> float:
+        """# Account n bytes of a bulk transfer, waiting for budget if needed
+        - direction: download, upload
+        """
+        rate_cap = self.yield_rate if self.interactive_active() else None
+        names = [direction, self.DIRECTIONS[direction]]
+
+        if self.shared is None:
+            waited = sum(self.buckets[name].consume(n, rate_cap) for name in names)
+        else:
+            waited = self.reserve(direction, names, n, rate_cap)
+
+        if waited > 0 and self.on_wait is not None:
+            self.on_wait(direction, waited)
+
+        return waited
+
+    def reserve(self, direction, names, n, rate_cap) -> float:
+        """# Take n bytes from the local allowance, reserving a block from the shared buckets when it runs out
+        """
+        buckets = []
+        for name in names:
+            bucket = self.buckets[name]
+            (rate, burst) = (bucket.rate, bucket.burst)
+            if rate_cap is not None and (rate is None or rate_cap < rate):
+                (rate, burst) = (rate_cap, None)
+            if rate is not None:
+                buckets.append((name, rate, burst or rate))
+
+        if not buckets:
+            return 0.0
+
+        waited = 0.0
+
+        with self.reserve_lock:
+            if self.allowance[direction] < n:
+                block = max(n, min(RESERVE_BLOCK, min(burst for (_, _, burst) in buckets) / 4))
+                waited = self.shared.consume(buckets, block)
+                self.allowance[direction] += block
+            self.allowance[direction] -= n
+
+        return waited
@@ -0,0 +1,102 @@
+from typing import List, Optional
+
+# Parsed once from the API response, keeping only the fields the bot uses.
+# __slots__ keeps thousands of cached videos small during ranking refreshes
+# and backfills.
+
+
+class User:
+    __slots__ = ("username", "name")
+
+    def __init__(self, username, name):
+        self.username = username
+        self.name = name
+
+    @classmethod
+    def from_json(cls, data) -> "User":
+        return cls(data['username'], data['name'])
+
+    def __repr__(self):
+        return "User({!r}, {!r})".format(self.username, self.name)
+
+
+class Tag:
+    __slots__ = ("id",)
+
+    def __init__(self, id):
+        self.id = id
+
+    @classmethod
+    def from_json(cls, data) -> "Tag":
+        return cls(data['id'])
+
+    def __repr__(self):
+        return "Tag({!r})".format(self.id)
+
+
+class FileResource:
+    """# A downloadable quality of a video file
+    - name: Source, 1080, 720, 540, 480, 360, preview
+    - download: protocol-relative download link
+    """
+    __slots__ = ("name", "type", "download")
+
+    def __init__(self, name, type, download):
+        self.name = name
+        self.type = type
+        self.download = download
+
+    @classmethod
+    def from_json(cls, data) -> "FileResource":
+        return cls(data['name'], data['type'], data['src']['download'])
+
+    @property
+    def file_type(self) -> str:
+        return self.type.split('/')[1]
+
+    def __repr__(self):
+        return "FileResource({!r}, {!r})".format(self.name, self.type)
+
+
+class Video:
+    __slots__ = ("id", "title", "body", "user", "tags", "file_id", "file_url", "thumbnail",
+                 "embed_url", "num_likes", "num_views", "created_at")
+
+    def __init__(self, id, title, body, user, tags, file_id, file_url, thumbnail,
+                 embed_url, num_likes, num_views, created_at):
+        self.id = id
+        self.title = title
+        self.body = body
+        self.user: User = user
+        self.tags: List[Tag] = tags
+        self.file_id: Optional[str] = file_id
+        self.file_url: Optional[str] = file_url
+        self.thumbnail: Optional[int] = thumbnail
+        self.embed_url: Optional[str] = embed_url
+        self.num_likes = num_likes
+        self.num_views = num_views
+        self.created_at: Optional[str] = created_at
+
+    @classmethod
+    def from_json(cls, data) -> "Video":
+        """# Build from a /video/{id} response or a /videos listing entry
+        Listing entries have no fileUrl; YouTube embeds have no file.
+        """
+        file = data.get('file') or {}
+        return cls(
+            data['id'],
+            data['title'],
+            data.get('body'),
+            User.from_json(data['user']),
+            [Tag.from_json(tag) for tag in data.get('tags') or []],
+            file.get('id'),
+            data.get('fileUrl'),
+            data.get('thumbnail'),
+            data.get('embedUrl'),
+            int(data.get('numLikes') or 0),
+            int(data.get('numViews') or 0),
+            data.get('createdAt'),
+        )
+
+    def __repr__(self):
+        return "Video({!r}, {!r}, {!r})".format(self.id, self.title, self.user)
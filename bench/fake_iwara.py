@@ -0,0 +1,173 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Must match the X-Version key used by ApiClient.download_video
+SHA_postfix = "_5nFp9kmbNnHdAFhaqMvt"
+
+PAGE_SIZE = 32
+
+
+class FakeIwara:
+    """# Local stand-in for api.iwara.tv and files.iwara.tv
+
+    - num_videos: size of the catalog returned by /videos
+    - video_data / thumbnail_data: bytes served for every video
+    - latency: seconds added to every response
+    - bandwidth: bytes per second for file downloads, None for unlimited
+    - error_rate: fraction of requests answered with 503
+    """
+
+    def __init__(self, video_data, thumbnail_data, num_videos=32, latency=0.0, bandwidth=None, error_rate=0.0, port=0):
+        self.video_data = video_data
+        self.thumbnail_data = thumbnail_data
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+        self.videos = [self.make_video(i) for i in range(num_videos)]
+        self.videos_by_id = {video["id"]: video for video in self.videos}
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def make_video(self, i) -> dict:
+        return {
+            "id": "video{:05d}".format(i),
+            "title": "Video {}".format(i),
+            "body": "Description of video {}".format(i),
+            "user": {"username": "user{}".format(i % 7), "name": "User {}".format(i % 7)},
+            "tags": [{"id": "tag{}".format(i % 3)}],
+            "file": {"id": "file{:05d}".format(i)},
+            "thumbnail": 0,
+            "numLikes": random.randint(0, 1000),
+            "numViews": random.randint(0, 100000),
+            "embedUrl": None,
+            "createdAt": "2026-01-01T00:00:00.000Z",
+        }
+
+    def start(self) -> "FakeIwara":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_bytes(self, data, content_type):
+                start = 0
+                status = 200
+                match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                if match:
+                    start = int(match.group(1))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */{}".format(len(data)))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data) - start))
+                if status == 206:
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(data) - 1, len(data)))
+                self.end_headers()
+
+                chunk_size = 64 * 1024
+                for offset in range(start, len(data), chunk_size):
+                    chunk = data[offset:offset + chunk_size]
+                    self.wfile.write(chunk)
+                    if fake.bandwidth:
+                        time.sleep(len(chunk) / fake.bandwidth)
+                with fake.lock:
+                    fake.bytes_sent += len(data) - start
+
+            def before(self) -> bool:
+                with fake.lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if random.random() < fake.error_rate:
+                    self.send_json({"message": "errors.serviceUnavailable"}, 503)
+                    return False
+                return True
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.before():
+                    return
+                if self.path == "/user/login":
+                    self.send_json({"token": "fake-token"})
+                else:
+                    self.send_json({"message": "errors.notFound"}, 404)
+
+            def do_GET(self):
+                if not self.before():
+                    return
+
+                url = urlsplit(self.path)
+                parts = url.path.strip("/").split("/")
+
+                if url.path == "/videos":
+                    page = int(parse_qs(url.query).get("page", ["0"])[0])
+                    results = fake.videos[::-1][page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+                    self.send_json({"count": len(fake.videos), "limit": PAGE_SIZE, "page": page, "results": results})
+
+                elif parts[0] == "video" and len(parts) == 2:
+                    if parts[1] not in fake.videos_by_id:
+                        self.send_json({"message": "errors.notFound"}, 404)
+                        return
+                    video = dict(fake.videos_by_id[parts[1]])
+                    expires = int(time.time()) + 3600
+                    video["fileUrl"] = "{}/file/{}?expires={}&hash=fake".format(fake.url, video["file"]["id"], expires)
+                    self.send_json(video)
+
+                elif parts[0] == "file" and len(parts) == 2:
+                    # 与真实服务器一样校验 X-Version
+                    file_id = parts[1]
+                    expires = parse_qs(url.query).get("expires", [""])[0]
+                    expected = hashlib.sha1((file_id + "_" + expires + SHA_postfix).encode("utf-8")).hexdigest()
+                    if self.headers.get("X-Version") != expected:
+                        self.send_json({"message": "errors.forbidden"}, 403)
+                        return
+                    host = fake.url.split(":", 1)[1]
+                    self.send_json([{"name": "Source", "type": "video/mp4",
+                                     "src": {"download": "{}/download/{}.mp4".format(host, file_id)}}])
+
+                elif parts[0] == "download":
+                    self.send_bytes(fake.video_data, "video/mp4")
+
+                elif parts[0] == "image":
+                    self.send_bytes(fake.thumbnail_data, "image/jpeg")
+
+                else:
+                    self.send_json({"message": "errors.notFound"}, 404)
+
+        return Handler
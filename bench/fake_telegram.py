@@ -0,0 +1,117 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+    """# Local stand-in for the Bot API server methods used by IwaraTgBot
+
+    - latency: seconds added to every response
+    - bandwidth: bytes per second accepted for uploads, None for unlimited
+    - error_rate: fraction of sendVideo calls answered with an error
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.calls = {}
+        self.bytes_received = 0
+        self.message_id = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+        self.url = "http://127.0.0.1:{}/bot".format(self.server.server_address[1])
+
+    def start(self) -> "FakeTelegram":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def next_message(self, chat_id, **fields) -> dict:
+        with self.lock:
+            self.message_id += 1
+            message_id = self.message_id
+        message = {"message_id": message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "channel", "title": "bench"}}
+        message.update(fields)
+        return message
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self) -> bytes:
+                remaining = int(self.headers.get("Content-Length", 0))
+                head = b""
+                # 只保留开头部分用于解析参数, 视频内容直接丢弃
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 64 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    if len(head) < 64 * 1024:
+                        head += chunk
+                    with fake.lock:
+                        fake.bytes_received += len(chunk)
+                    if fake.bandwidth:
+                        time.sleep(len(chunk) / fake.bandwidth)
+                return head
+
+            def params(self, body) -> dict:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    return json.loads(body or b"{}")
+                return {}
+
+            def do_POST(self):
+                body = self.read_body()
+                method = self.path.rsplit("/", 1)[-1]
+                params = self.params(body)
+
+                with fake.lock:
+                    fake.calls[method] = fake.calls.get(method, 0) + 1
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                chat_id = params.get("chat_id", 0)
+
+                if method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+                elif method in ("sendMessage", "editMessageText"):
+                    result = fake.next_message(chat_id, text=params.get("text", ""))
+                elif method == "deleteMessage":
+                    result = True
+                elif method == "sendVideo":
+                    if random.random() < fake.error_rate:
+                        self.send_json({"ok": False, "error_code": 500, "description": "Internal Server Error"})
+                        return
+                    result = fake.next_message(chat_id, video={
+                        "file_id": "video-file-{}".format(fake.message_id + 1),
+                        "file_unique_id": "unique-{}".format(fake.message_id + 1),
+                        "width": 640, "height": 360, "duration": 1})
+                else:
+                    self.send_json({"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+                    return
+
+                self.send_json({"ok": True, "result": result})
+
+        return Handler
@@ -0,0 +1,216 @@
+"""# End-to-end benchmark against local fake iwara and Bot API servers
+
+Usage: python bench/run.py [--videos N] [--frames N] [--latency S] [--bandwidth B/s]
+                           [--error-rate R] [--telegram-error-rate R] [--streaming]
+                           [--output result.json] [--baseline result.json] [--tolerance 0.1]
+
+Runs IwaraTgBot.download and IwaraTgBot.ranking in a temporary directory and
+reports videos/hour, bytes/s, peak RSS and time per stage. With --baseline,
+exits with status 1 if throughput dropped by more than --tolerance.
+
+The fake servers run in child processes, so peak RSS and throughput only
+measure the bot.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy
+
+from bench.fake_iwara import FakeIwara
+from bench.fake_telegram import FakeTelegram
+
+
+def make_sample_video(path, frames, width=640, height=360, fps=30) -> int:
+    """# Encode a small test clip that cv2 can probe, returns its size
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(frames):
+        frame = numpy.random.randint(0, 255, (height, width, 3), dtype=numpy.uint8)
+        writer.write(frame)
+    writer.release()
+
+    return os.path.getsize(path)
+
+
+def make_thumbnail() -> bytes:
+    image = numpy.zeros((360, 640, 3), dtype=numpy.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def make_fake_iwara(video_path, thumbnail_data, **options) -> FakeIwara:
+    with open(video_path, "rb") as f:
+        return FakeIwara(f.read(), thumbnail_data, **options)
+
+
+def serve(conn, factory, args, kwargs, stats):
+    """# Child process body: run a fake server until told to stop
+    """
+    server = factory(*args, **kwargs).start()
+    conn.send(server.url)
+    conn.recv()
+    conn.send({name: getattr(server, name) for name in stats})
+    server.stop()
+
+
+class ServerProcess:
+    """# Run a fake server in a child process
+    - stats: attributes of the server returned by stop()
+    """
+
+    def __init__(self, factory, *args, stats=(), **kwargs):
+        (self.conn, child_conn) = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child_conn, factory, args, kwargs, stats), daemon=True)
+        self.url = None
+
+    def start(self) -> "ServerProcess":
+        self.process.start()
+        self.url = self.conn.recv()
+        return self
+
+    def stop(self) -> dict:
+        self.conn.send("stop")
+        stats = self.conn.recv()
+        self.process.join()
+        return stats
+
+
+def write_config(path, iwara, telegram, streaming=False):
+    config = {
+        "user_info": {"user_name": "bench@example.com", "password": "bench"},
+        "telegram_info": {
+            "token": "123456:bench",
+            "chat_id": "-1001",
+            "ranking_id": "-1002",
+            "APIServer": telegram.url,
+        },
+        "streaming": {"enabled": streaming},
+    }
+    with open(path, "w") as f:
+        json.dump(config, f, indent=4)
+
+
+def stage_times() -> dict:
+    from metrics import STAGE_SECONDS
+
+    return {stage: round(STAGE_SECONDS.get_sum(stage=stage), 3)
+            for stage in ("listing", "metadata", "download", "faststart", "probe", "upload", "stream", "db")}
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="iwara-bench-")
+    cwd = os.getcwd()
+
+    iwara = None
+    telegram = None
+
+    try:
+        os.chdir(workdir)
+
+        # 样本视频只由子进程读入内存, 不计入本进程的 RSS
+        sample_path = os.path.join(workdir, "sample.mp4")
+        video_bytes = make_sample_video(sample_path, args.frames)
+
+        iwara = ServerProcess(make_fake_iwara, sample_path, make_thumbnail(), stats=("requests",),
+                              num_videos=args.videos, latency=args.latency,
+                              bandwidth=args.bandwidth, error_rate=args.error_rate).start()
+        telegram = ServerProcess(FakeTelegram, stats=("calls",), latency=args.latency,
+                                 bandwidth=args.bandwidth, error_rate=args.telegram_error_rate).start()
+        write_config("config.json", iwara, telegram, args.streaming)
+
+        from main import IwaraTgBot
+        from metrics import TRANSFER_BYTES, VIDEOS
+
+        bot = IwaraTgBot()
+        bot.client.api_url = iwara.url
+        bot.client.file_url = iwara.url
+        bot.client.request_delay = (0, 0)
+        bot.forward_delay = 0
+
+        start = time.perf_counter()
+        bot.download()
+        download_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bot.ranking("DAILY")
+        ranking_seconds = time.perf_counter() - start
+
+        videos = VIDEOS.get(result="done")
+        downloaded = TRANSFER_BYTES.get(direction="download")
+        uploaded = TRANSFER_BYTES.get(direction="upload")
+        peak_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+        iwara_stats = iwara.stop()
+        telegram_stats = telegram.stop()
+        iwara = telegram = None
+
+        return {
+            "videos": videos,
+            "video_bytes": video_bytes,
+            "download_seconds": round(download_seconds, 3),
+            "ranking_seconds": round(ranking_seconds, 3),
+            "videos_per_hour": round(videos / download_seconds * 3600, 1) if download_seconds else 0,
+            "download_bytes_per_second": round(downloaded / download_seconds) if download_seconds else 0,
+            "upload_bytes_per_second": round(uploaded / download_seconds) if download_seconds else 0,
+            "peak_rss_mb": peak_rss_mb,
+            "stage_seconds": stage_times(),
+            "iwara_requests": iwara_stats["requests"],
+            "telegram_calls": telegram_stats["calls"],
+        }
+    finally:
+        os.chdir(cwd)
+        # 正常结束时已在上面停止, 这里只处理出错的情况
+        if iwara is not None:
+            iwara.process.terminate()
+        if telegram is not None:
+            telegram.process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IwaraTgBot against local fake servers")
+    parser.add_argument("--videos", type=int, default=32, help="number of videos in the fake catalog")
+    parser.add_argument("--frames", type=int, default=300, help="frames in the sample video")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second for file transfers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of iwara requests failing with 503")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="fraction of sendVideo calls failing")
+    parser.add_argument("--streaming", action="store_true", help="pipe downloads straight into uploads")
+    parser.add_argument("--output", help="write the result as JSON")
+    parser.add_argument("--baseline", help="result JSON of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed throughput drop vs. baseline")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=4))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for key in ("videos_per_hour", "download_bytes_per_second", "upload_bytes_per_second"):
+            if baseline.get(key) and result[key] < baseline[key] * (1 - args.tolerance):
+                regressions.append("{}: {} -> {}".format(key, baseline[key], result[key]))
+
+        if regressions:
+            print("Throughput regression:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
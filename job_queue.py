@@ -0,0 +1,302 @@
+import importlib
+import json
+import sqlite3
+import time
+from typing import Dict, Optional
+
+# Job states
+PENDING = "pending"        # 等待 worker 领取
+CLAIMED = "claimed"        # 已被 worker 领取, 租约有效期内由其处理
+READY = "ready"            # 已下载并上传到暂存频道, 等待发布
+PUBLISHED = "published"    # 已按顺序发布到频道
+FAILED = "failed"          # 超过最大重试次数
+
+
+class Job:
+    """# A single video job
+    """
+
+    def __init__(self, id, video_id, table_name, state, worker=None, attempts=0, payload=None, result=None, error=None):
+        self.id = id
+        self.video_id = video_id
+        self.table_name = table_name
+        self.state = state
+        self.worker = worker
+        self.attempts = attempts
+        self.payload = payload or {}
+        self.result = result or {}
+        self.error = error
+
+    def __repr__(self):
+        return "Job({}, {}, {}, {})".format(self.id, self.video_id, self.table_name, self.state)
+
+
+class QueueBackend:
+    """# Storage interface of the job queue
+
+    Jobs are ordered by the sequence they were enqueued in. Workers claim
+    jobs with a lease that must be renewed with `heartbeat` before it
+    expires, otherwise the job goes back to other workers. The publisher
+    walks jobs strictly in sequence order.
+    """
+
+    def enqueue(self, video_id, table_name, payload=None) -> bool:
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds, max_attempts) -> Optional[Job]:
+        raise NotImplementedError
+
+    def heartbeat(self, job_id, worker_id, lease_seconds) -> bool:
+        raise NotImplementedError
+
+    def complete(self, job_id, worker_id, result) -> bool:
+        raise NotImplementedError
+
+    def fail(self, job_id, worker_id, error, max_attempts) -> None:
+        raise NotImplementedError
+
+    def next_to_publish(self) -> Optional[Job]:
+        raise NotImplementedError
+
+    def mark_published(self, job_id) -> None:
+        raise NotImplementedError
+
+    def mark_failed(self, job_id, error) -> None:
+        raise NotImplementedError
+
+    def counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """# SQLite job queue
+
+    - path: database file shared by enqueue, workers and the publisher
+    - journal_mode: WAL (default) or DELETE
+
+    With WAL, any number of worker processes on the same host can share the
+    database, but WAL keeps its index in shared memory and does not work
+    over network filesystems. To run workers on several hosts against a
+    database on a shared mount (NFS/SMB with working POSIX locks), set
+    journal_mode to DELETE, which only relies on file locks. For mounts
+    without reliable locking, plug in another backend as "module:Class".
+    """
+
+    def __init__(self, path="IwaraQueue.db", journal_mode="WAL"):
+        if journal_mode.upper() not in ("WAL", "DELETE"):
+            raise ValueError("Unsupported journal_mode: {}".format(journal_mode))
+        self.path = path
+        self.journal_mode = journal_mode.upper()
+        self.init_DB()
+
+    def connect_DB(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode={}".format(self.journal_mode))
+        c = conn.cursor()
+        return c, conn
+
+    def close_DB(self, conn):
+        conn.close()
+
+    def init_DB(self):
+        c, conn = self.connect_DB()
+
+        c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT,
+            table_name TEXT,
+            state TEXT,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER DEFAULT 0,
+            payload TEXT,
+            result TEXT,
+            error TEXT,
+            UNIQUE (video_id, table_name)
+        )""")
+        c.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, seq)")
+
+        self.close_DB(conn)
+
+    def _to_job(self, row) -> Optional[Job]:
+        if row is None:
+            return None
+        (seq, video_id, table_name, state, worker, attempts, payload, result, error) = row
+        return Job(seq, video_id, table_name, state, worker, attempts,
+                   json.loads(payload) if payload else None,
+                   json.loads(result) if result else None,
+                   error)
+
+    def _select(self):
+        return "SELECT seq, video_id, table_name, state, worker, attempts, payload, result, error FROM jobs "
+
+    def enqueue(self, video_id, table_name, payload=None) -> bool:
+        c, conn = self.connect_DB()
+
+        c.execute("""INSERT OR IGNORE INTO jobs (video_id, table_name, state, payload)
+            VALUES (?, ?, ?, ?)""", (video_id, table_name, PENDING, json.dumps(payload or {})))
+        added = c.rowcount == 1
+
+        self.close_DB(conn)
+
+        return added
+
+    def claim(self, worker_id, lease_seconds, max_attempts) -> Optional[Job]:
+        c, conn = self.connect_DB()
+        now = time.time()
+
+        try:
+            # 加写锁, 保证同一个任务只会被一个 worker 领取
+            c.execute("BEGIN IMMEDIATE")
+            # worker 崩溃 (如 OOM) 时不会调用 fail, 租约过期且次数用尽的任务在此标记失败
+            c.execute("""UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL,
+                error = COALESCE(error, 'Lease expired')
+                WHERE state = ? AND lease_expires < ? AND attempts >= ?""",
+                      (FAILED, CLAIMED, now, max_attempts))
+            c.execute(self._select() + """WHERE state = ? OR (state = ? AND lease_expires < ?)
+                ORDER BY seq LIMIT 1""", (PENDING, CLAIMED, now))
+            job = self._to_job(c.fetchone())
+
+            if job is not None:
+                c.execute("""UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE seq = ?""", (CLAIMED, worker_id, now + lease_seconds, job.id))
+                job.state = CLAIMED
+                job.worker = worker_id
+                job.attempts += 1
+
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        finally:
+            self.close_DB(conn)
+
+        return job
+
+    def heartbeat(self, job_id, worker_id, lease_seconds) -> bool:
+        c, conn = self.connect_DB()
+
+        c.execute("UPDATE jobs SET lease_expires = ? WHERE seq = ? AND worker = ? AND state = ?",
+                  (time.time() + lease_seconds, job_id, worker_id, CLAIMED))
+        renewed = c.rowcount == 1
+
+        self.close_DB(conn)
+
+        return renewed
+
+    def complete(self, job_id, worker_id, result) -> bool:
+        c, conn = self.connect_DB()
+
+        c.execute("""UPDATE jobs SET state = ?, result = ?, lease_expires = NULL, error = NULL
+            WHERE seq = ? AND worker = ? AND state = ?""",
+                  (READY, json.dumps(result), job_id, worker_id, CLAIMED))
+        completed = c.rowcount == 1
+
+        self.close_DB(conn)
+
+        return completed
+
+    def fail(self, job_id, worker_id, error, max_attempts) -> None:
+        c, conn = self.connect_DB()
+
+        c.execute("""UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+            worker = NULL, lease_expires = NULL, error = ?
+            WHERE seq = ? AND worker = ? AND state = ?""",
+                  (max_attempts, FAILED, PENDING, str(error), job_id, worker_id, CLAIMED))
+
+        self.close_DB(conn)
+
+    def next_to_publish(self) -> Optional[Job]:
+        c, conn = self.connect_DB()
+
+        # 第一个尚未发布且未失败的任务, 保证频道内顺序与入队顺序一致
+        c.execute(self._select() + "WHERE state NOT IN (?, ?) ORDER BY seq LIMIT 1", (PUBLISHED, FAILED))
+        job = self._to_job(c.fetchone())
+
+        self.close_DB(conn)
+
+        return job
+
+    def mark_published(self, job_id) -> None:
+        c, conn = self.connect_DB()
+
+        c.execute("UPDATE jobs SET state = ? WHERE seq = ? AND state = ?", (PUBLISHED, job_id, READY))
+
+        self.close_DB(conn)
+
+    def mark_failed(self, job_id, error) -> None:
+        c, conn = self.connect_DB()
+
+        c.execute("UPDATE jobs SET state = ?, error = ? WHERE seq = ? AND state = ?",
+                  (FAILED, str(error), job_id, READY))
+
+        self.close_DB(conn)
+
+    def counts(self) -> Dict[str, int]:
+        c, conn = self.connect_DB()
+
+        c.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        counts = {state: n for (state, n) in c.fetchall()}
+
+        self.close_DB(conn)
+
+        return counts
+
+
+BACKENDS = {
+    "sqlite": SQLiteQueueBackend,
+}
+
+
+class JobQueue:
+    """# Distributed download/upload job queue
+
+    - backend: a name from BACKENDS or "module:Class" of a QueueBackend subclass
+    - lease: seconds a claimed job stays with its worker without a heartbeat
+    - max_attempts: a job is marked failed after this many claims, or
+      after this many failed attempts to publish it
+    """
+
+    def __init__(self, backend="sqlite", lease=600, max_attempts=3, **options):
+        if backend in BACKENDS:
+            backend_class = BACKENDS[backend]
+        else:
+            module_name, class_name = backend.split(":")
+            backend_class = getattr(importlib.import_module(module_name), class_name)
+
+        self.backend = backend_class(**options)
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_config(cls, config) -> "JobQueue":
+        return cls(**config.get("queue", {}))
+
+    def enqueue(self, video_id, table_name, payload=None) -> bool:
+        return self.backend.enqueue(video_id, table_name, payload)
+
+    def claim(self, worker_id) -> Optional[Job]:
+        return self.backend.claim(worker_id, self.lease, self.max_attempts)
+
+    def heartbeat(self, job) -> bool:
+        return self.backend.heartbeat(job.id, job.worker, self.lease)
+
+    def complete(self, job, result) -> bool:
+        return self.backend.complete(job.id, job.worker, result)
+
+    def fail(self, job, error) -> None:
+        self.backend.fail(job.id, job.worker, error, self.max_attempts)
+
+    def next_to_publish(self) -> Optional[Job]:
+        return self.backend.next_to_publish()
+
+    def mark_published(self, job) -> None:
+        self.backend.mark_published(job.id)
+
+    def mark_failed(self, job, error) -> None:
+        """# Give up publishing a ready job so the jobs after it can go out
+        """
+        self.backend.mark_failed(job.id, error)
+
+    def counts(self) -> Dict[str, int]:
+        return self.backend.counts()
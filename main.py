@@ -1,17 +1,82 @@
 
 import json
+import logging
 import os
+import signal
+import socket
 import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 
 import cv2
+import mp4
+import telegram
+import telegram_upload
 from api.api_client import ApiClient
+from api.bandwidth import BandwidthGovernor
+from api.models import Video
 from dateutil.relativedelta import relativedelta
+from job_queue import READY, JobQueue
+from metrics import (BANDWIDTH_WAIT, FAILURES, QUEUE_DEPTH, RATE_LIMIT_WAIT, REGISTRY,
+                     RETRIES, STAGE_SECONDS, TRANSFER_BYTES, TRANSFER_RATE, VIDEOS)
 from telegram.ext import Updater
 
+logger = logging.getLogger("iwara-bot")
+
+# Per-video states persisted in videoJournal, in order
+JOURNAL_STATES = ["discovered", "metadata", "downloaded", "uploaded", "recorded", "tagged", "described"]
+
+
+def failure_cause(e) -> str:
+    """# Label of FAILURES, looking through exceptions that only add context
+    """
+    return type(e.__cause__ or e).__name__
+
+
+class RateLimiter:
+    """# Space out requests made from several threads
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            RATE_LIMIT_WAIT.inc(delay)
+            time.sleep(delay)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """# Cursor that records query time in the "db" stage
+    Rows are produced while fetching, so fetches are timed as well.
+    """
+
+    def execute(self, *args):
+        with STAGE_SECONDS.time(stage="db"):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with STAGE_SECONDS.time(stage="db"):
+            return super().executemany(*args)
+
+    def fetchone(self):
+        with STAGE_SECONDS.time(stage="db"):
+            return super().fetchone()
+
+    def fetchall(self):
+        with STAGE_SECONDS.time(stage="db"):
+            return super().fetchall()
+
 
 class IwaraTgBot:
     def __init__(self, ecchi=False):
@@ -26,44 +91,54 @@ class IwaraTgBot:
         self.config = json.load(open("config.json"))
         self.videoUrl = "https://iwara.tv/video"
         self.userUrl = "https://iwara.tv/profile"
+        self.forward_delay = 5  # 等待频道消息转发到讨论组的时间(秒)
+        self.publish_delay = 5  # 发布失败后首次重试的等待时间(秒), 之后每次翻倍
+
+        # Bandwidth shared by downloads and uploads
+        self.governor = BandwidthGovernor.from_config(self.config)
+        self.governor.on_wait = lambda direction, seconds: BANDWIDTH_WAIT.inc(seconds, direction=direction)
 
         # Setup Iwara API Client
         self.client = ApiClient(
-            self.config["user_info"]["user_name"], self.config["user_info"]["password"])
+            self.config["user_info"]["user_name"], self.config["user_info"]["password"], governor=self.governor)
+        self.client.on_wait = lambda seconds: RATE_LIMIT_WAIT.inc(seconds)
 
         # Init DB
         self.DBpath = "IwaraTgDB.db"
+        self.max_attempts = 5  # 中断的视频最多恢复次数
 
         # Setup telegram bot
-        print("Connecting to telegram bot...")
+        logger.info("Connecting to telegram bot...")
         self.updater = Updater(
             self.config["telegram_info"]["token"], base_url=self.config["telegram_info"]["APIServer"])
         self.bot = self.updater.bot
         botInfo = self.bot.getMe()
-        print("Connected to telegram bot: " + botInfo.first_name)
+        logger.info("Connected to telegram bot: " + botInfo.first_name)
 
     def login(self) -> bool:
         """ Login to iwara.tv """
 
         # Login
-        print("Logging in...")
+        logger.info("Logging in...")
         r = self.client.login()
 
         if r.status_code == 200:
-            print("Login success")
+            logger.info("Login success")
             return True
         else:
-            print("Login failed")
+            logger.error("Login failed")
             return False
 
     def connect_DB(self):
-        conn = sqlite3.connect(self.DBpath)
-        c = conn.cursor()
+        with STAGE_SECONDS.time(stage="db"):
+            conn = sqlite3.connect(self.DBpath)
+            c = conn.cursor(factory=TimedCursor)
         return c, conn
 
     def close_DB(self, conn):
-        conn.commit()
-        conn.close()
+        with STAGE_SECONDS.time(stage="db"):
+            conn.commit()
+            conn.close()
 
     def init_DB(self, tableName):
         c, conn = self.connect_DB()
@@ -141,7 +216,7 @@ class IwaraTgBot:
                                            text=message)
             except telegram.error.BadRequest as e:
                 if str(e).startswith("Message is not modified"):
-                    print("Author tags message not modified, skipping edit.")
+                    logger.info("Author tags message not modified, skipping edit.")
                 else:
                     raise e
 
@@ -153,6 +228,7 @@ class IwaraTgBot:
 
         c.execute("""INSERT INTO """ + tableName + """ (id, title, user, user_display, date, chat_id, views, likes) 
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET date = excluded.date, chat_id = excluded.chat_id
         """,
                   (id, title, user, user_display, int(datetime.now().strftime("%Y%m%d")), chat_id, views, likes,))
 
@@ -161,7 +237,8 @@ class IwaraTgBot:
     def is_video_exist(self, tableName, id):
         c, conn = self.connect_DB()
 
-        c.execute("SELECT * FROM " + tableName + " WHERE id = ?", (id,))
+        # 回填的视频没有 chat_id, 不算已发送
+        c.execute("SELECT * FROM " + tableName + " WHERE id = ? AND chat_id IS NOT NULL", (id,))
         if c.fetchone() is None:
             result = False
         else:
@@ -171,38 +248,37 @@ class IwaraTgBot:
 
         return result
 
-    def get_video_info(self, id):
-        """# Extract video info from video object
+    def get_video_info(self, id) -> dict:
+        """# Extract the fields used for posting from a video
+        The result is plain JSON so it can be stored in the journal and job queue.
         """
 
         try:
-            video = self.client.get_video(id).json()
+            with STAGE_SECONDS.time(stage="metadata"):
+                video = self.client.get_video(id)
         except Exception as e:
+            FAILURES.inc(stage="metadata", cause=failure_cause(e))
             raise e
 
-        title = video["title"]
-        user = video["user"]['username']
-        user_display = video["user"]['name']
-        description = video['body']
-        tags = [user_display]
-        for tag in video["tags"]:
-            tags.append(tag["id"])
-
-        thumbFileName = video["id"] + ".jpg"
+        tags = [video.user.name]
+        for tag in video.tags:
+            tags.append(tag.id)
 
-        return [title, user, user_display, description, tags, thumbFileName]
+        return {"title": video.title,
+                "user": video.user.username,
+                "user_display": video.user.name,
+                "description": video.body,
+                "v_tags": tags,
+                "yt_link": self.get_youtube_link(video)}
 
-    def get_video_stat(self, video):
+    def get_video_stat(self, video) -> Tuple[int, int]:
         """# Extract video stats from video object
         """
 
-        likes = int(video['numLikes'])
-        views = int(video['numViews'])
+        return (video.num_likes, video.num_views)
 
-        return [likes, views]
-
-    def find_videos(self, subscribed=False, num_pages=5) -> List:
-        print("Finding videos... (rating: {}, subscribed: {})".format(
+    def find_videos(self, subscribed=False, num_pages=5) -> List[Video]:
+        logger.info("Finding videos... (rating: {}, subscribed: {})".format(
             self.rating, subscribed))
 
         if (subscribed and self.client.token == None):
@@ -212,48 +288,75 @@ class IwaraTgBot:
 
         for page in range(num_pages):
             try:
-                videos += (self.client.get_videos(sort='date', rating=self.rating,
-                           page=page, subscribed=subscribed).json()['results'])
+                with STAGE_SECONDS.time(stage="listing"):
+                    videos += self.client.iter_videos(sort='date', rating=self.rating,
+                                                      page=page, subscribed=subscribed)
             except Exception as e:
-                print("Error: {}".format(e))
+                FAILURES.inc(stage="listing", cause=failure_cause(e))
+                logger.error("Error: {}".format(e))
 
         return videos
 
     def download_video(self, id) -> Optional[str]:
         try:
-            print("Downloading video {}...".format(id))
-            return self.download_with_retry(self.client.download_video, id)
+            logger.info("Downloading video {}...".format(id))
+            start = time.perf_counter()
+            with STAGE_SECONDS.time(stage="download"):
+                videoFileName = self.download_with_retry(self.client.download_video, id, stage="download")
+            self.record_transfer("download", os.path.getsize(videoFileName), time.perf_counter() - start)
+            self.faststart_video(videoFileName)
+            return videoFileName
         except Exception as e:  # Download Failed
-            print("Download Failed: {}".format(e))
+            FAILURES.inc(stage="download", cause=failure_cause(e))
+            logger.error("Download Failed: {}".format(e))
             return None
 
+    def faststart_video(self, path):
+        """# Move the moov atom to the front so telegram can stream the video
+        """
+        if not path.lower().endswith((".mp4", ".m4v", ".mov")):
+            return
+
+        try:
+            with STAGE_SECONDS.time(stage="faststart"):
+                if mp4.faststart(path):
+                    logger.info("Moved moov atom to the front of {}".format(path))
+        except (mp4.Mp4Error, OSError) as e:
+            # 改写失败时原文件保持不变, 照常上传
+            FAILURES.inc(stage="faststart", cause=failure_cause(e))
+            logger.warning("Faststart failed for {}: {}".format(path, e))
+
     def download_video_thumbnail(self, id) -> Optional[str]:
         try:
-            print("Downloading thumbnail for video {}...".format(id))
-            return self.download_with_retry(self.client.download_video_thumbnail, id)
+            logger.info("Downloading thumbnail for video {}...".format(id))
+            return self.download_with_retry(self.client.download_video_thumbnail, id, stage="thumbnail")
         except Exception as e:  # Download Failed
-            print("Download Thumbnail Failed: {}".format(e))
+            FAILURES.inc(stage="thumbnail", cause=failure_cause(e))
+            logger.error("Download Thumbnail Failed: {}".format(e))
             return None
 
-    def download_with_retry(self, download_func, *args, max_retries=3, delay=1, **kwargs):
+    def download_with_retry(self, download_func, *args, max_retries=3, delay=1, stage="download", **kwargs):
         for attempt in range(max_retries):
             try:
                 return download_func(*args, **kwargs)
             except Exception as e:
                 if attempt < max_retries - 1:
-                    print(
+                    RETRIES.inc(stage=stage)
+                    logger.warning(
                         f"Download failed: {e}. Retrying in {delay} seconds...")
                     time.sleep(delay)
                 else:
-                    print(
+                    logger.error(
                         f"Download failed after {max_retries} attempts. Giving up.")
                     raise
 
+    def record_transfer(self, direction, size, seconds):
+        TRANSFER_BYTES.inc(size, direction=direction)
+        if seconds > 0:
+            TRANSFER_RATE.set(size / seconds, direction=direction)
+
     def get_youtube_link(self, video) -> Optional[str]:
-        try:
-            return video["embedUrl"]
-        except:
-            return None
+        return video.embed_url
 
     def send_yt_link(self, yt_link, id="", title="", user="", user_display="", description="", v_tags=[]):
 
@@ -284,105 +387,261 @@ by: <a href="{}/{}/">{}</a>
         return msg.message_id
 
     def send_video(self, path, id="", title="", user="", user_display="", description=None, v_tags=None, thumbPath=""):
-        description = "" if description is None else description
-        v_tags = [] if v_tags is None else v_tags
+        return self.upload_video(path, id, title, user, user_display, description, v_tags, thumbPath).message_id
+
+    def build_caption(self, id, title, user, user_display, description, height, width) -> str:
+        """# Caption of a video message, with author, resolution and orientation tags
+        """
         # 定义黑名单列表
         blacklist = ["支付宝", "微信", "qq", "patreon", "paypal", "网址", "support", "支持", "群", "公告",
                      "永久", "QQ",  "定制", "高清", "4k", "视频", "fanbox", "链接", "Support"]  # 根据你的需求添加黑名单词汇
 
         # 检查描述是否包含黑名单中的词汇
         if any(word in description for word in blacklist):
-            print(
+            logger.info(
                 f"Video ID {id} contains blacklisted words in description. Removing description...")
             description = ""  # 如果描述中包含黑名单词汇,将描述设为空字符串
 
-        # Sending video to telegram
-        print("Sending video {} to telegram...".format(path))
-
         try:
             chat_ad = self.config["telegram_info"]["chat_ad"]
         except:
             chat_ad = ""
 
-        try:
-            cap = cv2.VideoCapture(path)
-            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-            frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            duration = frame_count / fps
         # 根据视频分辨率添加标签
-            resolution_tag = ""
-            if height >= 2160:
-               resolution_tag = "4K"
-            elif height >= 1080:
-               resolution_tag = "1080p"
-            elif height >= 720:
-               resolution_tag = "720p"
+        resolution_tag = ""
+        if height >= 2160:
+           resolution_tag = "4K"
+        elif height >= 1080:
+           resolution_tag = "1080p"
+        elif height >= 720:
+           resolution_tag = "720p"
         # 检查视频比例是否为竖屏
-            orientation_tag = ""
-            if height > width:
-               orientation_tag = "PortraitScreen"
+        orientation_tag = ""
+        if height > width:
+           orientation_tag = "PortraitScreen"
 
-            caption = """
+        caption = """
 <a href="{}/{}/">{}</a>
 by: <a href="{}/{}/">{}</a>
 {}
 """.format(self.videoUrl, id, title, self.userUrl, user, user_display, description)
-            if description:
-                caption += "\n\n" + description
+        if description:
+            caption += "\n\n" + description
+
+            caption += "\n\n" + chat_ad
 
-                caption += "\n\n" + chat_ad
+        if user_display:
+            # 将作者名字中的空格替换为下划线,作为一个完整的标签
+            caption += "\n#" + user_display.replace(" ", "_")
 
-            if user_display:
-                # 将作者名字中的空格替换为下划线,作为一个完整的标签
-                caption += "\n#" + user_display.replace(" ", "_")
+        if resolution_tag:
+            caption += "\n#" + resolution_tag
 
-            if resolution_tag:
-                caption += "\n#" + resolution_tag
+        if orientation_tag:
+            caption += "\n#" + orientation_tag
 
-            if orientation_tag:
-                caption += "\n#" + orientation_tag
+        return caption
+
+    def upload_video(self, path, id="", title="", user="", user_display="", description=None, v_tags=None, thumbPath="", chat_id=None):
+        """# Upload a video file to telegram and return the message
+        - chat_id: defaults to the channel
+        """
+        chat_id = self.config["telegram_info"]["chat_id"] if chat_id is None else chat_id
+        description = "" if description is None else description
+        v_tags = [] if v_tags is None else v_tags
+
+        # Sending video to telegram
+        logger.info("Sending video {} to telegram...".format(path))
+
+        try:
+            with STAGE_SECONDS.time(stage="probe"):
+                cap = cv2.VideoCapture(path)
+                height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+                width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+                frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+                fps = cap.get(cv2.CAP_PROP_FPS)
+                cap.release()
+            duration = frame_count / fps
+
+            caption = self.build_caption(id, title, user, user_display, description, height, width)
 
             msg = None
+            size = os.path.getsize(path)
+            start = time.perf_counter()
 
             try:
-                msg = self.bot.send_video(chat_id=self.config["telegram_info"]["chat_id"],
-                                          video=open(path, 'rb'),
-                                          supports_streaming=True,
-                                          timeout=300,
-                                          height=height,
-                                          width=width,
-                                          duration=duration,
-                                          caption=caption,
-                                          # Thumbnail
-                                          thumb=open(thumbPath, 'rb'),
-                                          parse_mode="HTML")
+                msg = self.post_video(chat_id, path, thumbPath, caption, height, width, duration, parse_mode="HTML")
             except:
-                msg = self.bot.send_video(chat_id=self.config["telegram_info"]["chat_id"],
-                                          video=open(path, 'rb'),
-                                          supports_streaming=True,
-                                          timeout=300,
-                                          height=height,
-                                          width=width,
-                                          duration=duration,
-                                          caption=caption,
-                                          # Thumbnail
-                                          thumb=open(thumbPath, 'rb'),
-                                          )
+                msg = self.post_video(chat_id, path, thumbPath, caption, height, width, duration)
+
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="upload")
+            self.record_transfer("upload", size, time.perf_counter() - start)
 
             # Delete the video form server
             os.remove(thumbPath)
             os.remove(path)
 
-            return msg.message_id
+            return msg
 
         except Exception as e:
+            FAILURES.inc(stage="upload", cause=failure_cause(e))
             # Delete the video form server
             os.remove(thumbPath)
             os.remove(path)
             raise e
 
+    def post_video(self, chat_id, path, thumbPath, caption, height, width, duration, parse_mode=None) -> telegram.Message:
+        """# sendVideo with the file streamed through the bandwidth governor
+        """
+        with open(path, 'rb') as video, open(thumbPath, 'rb') as thumb:
+            result = telegram_upload.send_video(
+                self.bot.base_url,
+                {"chat_id": chat_id,
+                 "supports_streaming": "true",
+                 "height": int(height),
+                 "width": int(width),
+                 "duration": int(round(duration)),
+                 "caption": caption,
+                 "parse_mode": parse_mode},
+                [("video", os.path.basename(path), video, os.path.getsize(path)),
+                 # Thumbnail
+                 ("thumb", os.path.basename(thumbPath), thumb, os.path.getsize(thumbPath))],
+                governor=self.governor,
+                timeout=300)
+
+        return telegram.Message.de_json(result, self.bot)
+
+    def streaming_enabled(self) -> bool:
+        return self.config.get("streaming", {}).get("enabled", False)
+
+    def stream_video(self, id, title="", user="", user_display="", description=None, chat_id=None) -> Optional[telegram.Message]:
+        """# Pipe the CDN download straight into sendVideo without writing the video to disk
+        Returns None if the video cannot be streamed (no Content-Length, moov
+        not near the start of the file, or a failed transfer), in which case
+        the caller falls back to download_video and upload_video.
+        """
+        chat_id = self.config["telegram_info"]["chat_id"] if chat_id is None else chat_id
+        description = "" if description is None else description
+
+        streaming = self.config.get("streaming", {})
+        probe_size = streaming.get("probe_size", 1024 * 1024)
+        max_probe_size = streaming.get("max_probe_size", 64 * 1024 * 1024)
+        buffer_size = streaming.get("buffer_size", 16 * 1024 * 1024)
+
+        thumbPath = self.download_video_thumbnail(id)
+
+        if (thumbPath == None):
+            return None
+
+        try:
+            logger.info("Streaming video {} to telegram...".format(id))
+
+            (r, file_type) = self.client.open_video_stream(id)
+            chunks = r.iter_content(chunk_size=256 * 1024)
+
+            try:
+                # 上传前必须知道文件大小; 压缩传输时 Content-Length 与解码后的大小不一致
+                content_length = int(r.headers.get("Content-Length") or 0)
+                if content_length == 0 or r.headers.get("Content-Encoding", "identity") != "identity":
+                    logger.info("Video ID {} has no usable Content-Length, falling back to download".format(id))
+                    r.close()
+                    return None
+
+                # Read the first bytes and look for moov in front of mdat
+                with STAGE_SECONDS.time(stage="probe"):
+                    head = bytearray()
+                    for chunk in chunks:
+                        self.governor.throttle("download", len(chunk))
+                        head += chunk
+                        if len(head) >= probe_size:
+                            break
+
+                    location = mp4.locate_moov(head)
+                    if location is None or location[0] + location[1] > max_probe_size:
+                        logger.info("Video ID {} has no moov atom at the start, falling back to download".format(id))
+                        r.close()
+                        return None
+
+                    (moov_pos, moov_size) = location
+                    if len(head) < moov_pos + moov_size:
+                        for chunk in chunks:
+                            self.governor.throttle("download", len(chunk))
+                            head += chunk
+                            if len(head) >= moov_pos + moov_size:
+                                break
+
+                    info = mp4.probe_moov(head[moov_pos:moov_pos + moov_size])
+            except Exception:
+                r.close()
+                raise
+
+            ring = telegram_upload.RingBuffer(buffer_size)
+
+            def produce():
+                error = None
+                try:
+                    ring.write(head)
+                    for chunk in chunks:
+                        self.governor.throttle("download", len(chunk))
+                        ring.write(chunk)
+                except Exception as e:
+                    error = e
+                finally:
+                    r.close()
+                    ring.finish(error)
+
+            producer = threading.Thread(target=produce, name="stream-{}".format(id), daemon=True)
+
+            caption = self.build_caption(id, title, user, user_display, description, info["height"], info["width"])
+
+            start = time.perf_counter()
+            producer.start()
+
+            try:
+                # 视频数据只能读取一次, 无法像 upload_video 那样去掉 parse_mode 重试
+                with open(thumbPath, 'rb') as thumb:
+                    result = telegram_upload.send_video(
+                        self.bot.base_url,
+                        {"chat_id": chat_id,
+                         "supports_streaming": "true",
+                         "height": int(info["height"]),
+                         "width": int(info["width"]),
+                         "duration": int(round(info["duration"])),
+                         "caption": caption,
+                         "parse_mode": "HTML"},
+                        [("video", "{}.{}".format(id, file_type), ring, content_length),
+                         # Thumbnail
+                         ("thumb", os.path.basename(thumbPath), thumb, os.path.getsize(thumbPath))],
+                        governor=self.governor,
+                        timeout=300)
+            finally:
+                # 上传失败时生产者在下一次写入时退出
+                ring.close()
+
+            producer.join()
+
+            seconds = time.perf_counter() - start
+            STAGE_SECONDS.observe(seconds, stage="stream")
+            self.record_transfer("download", content_length, seconds)
+            self.record_transfer("upload", content_length, seconds)
+
+            return telegram.Message.de_json(result, self.bot)
+
+        except Exception as e:
+            FAILURES.inc(stage="stream", cause=failure_cause(e))
+            logger.warning("Streaming video {} failed, falling back to download: {}".format(id, e))
+            return None
+
+        finally:
+            os.remove(thumbPath)
+
+    def reload_bandwidth(self):
+        """# Apply the "bandwidth" section of config.json without restarting
+        """
+        config = json.load(open("config.json"))
+        self.governor.configure(**config.get("bandwidth", {}))
+        logger.info("Bandwidth limits reloaded: {}".format(config.get("bandwidth", {})))
+
     def send_description(self, user, user_display, description):
         msg_t = self.bot.send_message(
             chat_id=self.config["telegram_info"]["chat_id_discuss"], text="Getting message ID...")
@@ -401,111 +660,632 @@ by: <a href="{}/{}/">{}</a>
                                   text=msg_description, reply_to_message_id=msg_t.message_id - 1)
 
     def update_stat_after(self, date, tableName):
-        c, conn = self.connect_DB()
-
-        c.execute("""SELECT id FROM """ + tableName +
-                  " WHERE date >= ?", (date,))
-        entries = c.fetchall()
+        """# Refresh likes and views of videos created since date (YYYYMMDD)
+        Listing entries carry the stats, so the date-sorted listing is walked
+        back to date instead of calling get_video for every row, which would
+        take hours after a backfill.
+        """
+        limiter = RateLimiter(self.config.get("backfill", {}).get("interval", 1.0))
+        page = 0
+        updated = 0
 
-        for (id,) in entries:
+        while True:
             try:
-                # Debug
-                print("Updating video ID {}".format(id))
+                videos = list(self.fetch_page(page, False, limiter))
+            except Exception as e:
+                FAILURES.inc(stage="listing", cause=failure_cause(e))
+                logger.error("Error in fetching page {}: {}".format(page, e))
+                break
+
+            rows = []
+            finished = len(videos) == 0
+
+            for video in videos:
+                if video.created_at[:10].replace("-", "") < date:
+                    # 列表按日期倒序, 之后的视频都更早
+                    finished = True
+                    break
+                (likes, views) = self.get_video_stat(video)
+                rows.append((likes, views, video.id))
 
-                video = self.client.get_video(id).json()
+            c, conn = self.connect_DB()
+            c.executemany("""UPDATE """ + tableName +
+                          " SET likes = ?, views = ? WHERE id = ?", rows)
+            updated += c.rowcount
+            self.close_DB(conn)
 
-                # Debug
-                print(video)
+            if finished:
+                break
 
-                (likes, views) = self.get_video_stat(video)
+            page += 1
 
-                # Debug
-                print(id)
-                print(likes, views)
+        logger.debug("Updated stats of {} videos".format(updated))
 
-                c.execute("""UPDATE """ + tableName +
-                          " SET likes = ?, views = ? WHERE id = ?", (likes, views, id))
-            except Exception as e:
-                print("Error: {}".format(e))
-                pass
+    def init_journal(self):
+        c, conn = self.connect_DB()
+
+        c.execute("""CREATE TABLE IF NOT EXISTS videoJournal (
+            id TEXT,
+            table_name TEXT,
+            state TEXT,
+            attempts INTEGER DEFAULT 0,
+            info TEXT,
+            video_path TEXT,
+            thumb_path TEXT,
+            message_id INTEGER,
+            file_id TEXT,
+            updated REAL,
+            PRIMARY KEY (id, table_name)
+        )""")
 
         self.close_DB(conn)
 
-    def download(self, subscribed=False):
+    def get_journal(self, tableName, id) -> Optional[dict]:
+        c, conn = self.connect_DB()
 
-        tableName = "videosNew" if subscribed == False else "videosSub"
+        c.execute("""SELECT state, attempts, info, video_path, thumb_path, message_id, file_id
+            FROM videoJournal WHERE id = ? AND table_name = ?""", (id, tableName))
+        row = c.fetchone()
 
-        self.init_DB(tableName)
+        self.close_DB(conn)
 
-        if (not self.login()):
-            print("Login Failed")
-            return
+        if row is None:
+            return None
 
-        videos = self.find_videos(subscribed=subscribed)
+        (state, attempts, info, video_path, thumb_path, message_id, file_id) = row
+        return {"state": state, "attempts": attempts, "info": json.loads(info) if info else None,
+                "video_path": video_path, "thumb_path": thumb_path,
+                "message_id": message_id, "file_id": file_id}
 
-        # Download videos
-        for video in reversed(videos):
+    def set_journal(self, tableName, id, state, **fields):
+        """# Record that a video reached a state
+        - fields: info, video_path, thumb_path, message_id, file_id, attempts
+        """
+        if "info" in fields:
+            fields["info"] = json.dumps(fields["info"])
+
+        c, conn = self.connect_DB()
+
+        c.execute("""INSERT INTO videoJournal (id, table_name, state, updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id, table_name) DO UPDATE SET state = excluded.state, updated = excluded.updated""",
+                  (id, tableName, state, time.time()))
+        for (key, value) in fields.items():
+            c.execute("UPDATE videoJournal SET " + key + " = ? WHERE id = ? AND table_name = ?",
+                      (value, id, tableName))
 
-            id = video['id']
+        self.close_DB(conn)
+
+    def get_unfinished_videos(self, tableName) -> List[str]:
+        c, conn = self.connect_DB()
 
-            print("Found video ID {}".format(id))
+        c.execute("""SELECT id FROM videoJournal WHERE table_name = ? AND state != ? AND attempts < ?
+            ORDER BY rowid""", (tableName, JOURNAL_STATES[-1], self.max_attempts))
+        ids = [id for (id,) in c.fetchall()]
 
+        self.close_DB(conn)
+
+        return ids
+
+    def process_video(self, tableName, id) -> bool:
+        """# Run a video through the journal state machine
+        Each step resumes from the last state persisted in videoJournal, so a
+        crashed run never downloads or posts the same video twice.
+        """
+
+        entry = self.get_journal(tableName, id)
+
+        if entry is None:
             if (self.is_video_exist(tableName, id)):
-                print("Video ID {} Already sent, skipped. ".format(id))
-                continue
+                logger.info("Video ID {} Already sent, skipped. ".format(id))
+                return True
+            self.set_journal(tableName, id, "discovered")
+            entry = self.get_journal(tableName, id)
 
-            try:
-                video_info = self.get_video_info(id)
-            except Exception as e:
-                print("Error in getting video info: {}".format(e))
-                continue
+        state = entry["state"]
+
+        if state == JOURNAL_STATES[-1]:
+            logger.info("Video ID {} Already sent, skipped. ".format(id))
+            return True
 
-            print("[DEBUG] Video ID {} Info: ".format(id))
-            print(video_info)
+        if entry["attempts"] >= self.max_attempts:
+            logger.warning("Video ID {} failed {} times, skipped. ".format(id, entry["attempts"]))
+            return False
 
-            yt_link = self.get_youtube_link(video)
+        if state != "discovered":
+            logger.info("Resuming video ID {} from state {}".format(id, state))
 
-            title = video_info[0]
-            user = video_info[1]
-            user_display = video_info[2]
-            description = video_info[3]
-            v_tags = video_info[4]
+        self.set_journal(tableName, id, state, attempts=entry["attempts"] + 1)
 
+        # discovered -> metadata
+        if state == "discovered":
+            try:
+                video_info = self.get_video_info(id)
+            except Exception as e:
+                logger.error("Error in getting video info: {}".format(e))
+                return False
+
+            logger.debug("Video ID {} Info: {}".format(id, video_info))
+
+            entry["info"] = video_info
+            state = "metadata"
+            self.set_journal(tableName, id, state, info=entry["info"])
+
+        title = entry["info"]["title"]
+        user = entry["info"]["user"]
+        user_display = entry["info"]["user_display"]
+        description = entry["info"]["description"]
+        v_tags = entry["info"]["v_tags"]
+        yt_link = entry["info"]["yt_link"]
+
+        # metadata -> downloaded
+        if state == "downloaded" and yt_link == None and not (os.path.exists(entry["video_path"]) and os.path.exists(entry["thumb_path"])):
+            logger.info("Video ID {} files are missing, downloading again. ".format(id))
+            state = "metadata"
+
+        # metadata -> uploaded, without writing the video to disk
+        if state == "metadata" and yt_link == None and self.streaming_enabled():
+            msg = self.stream_video(id, title, user, user_display, description)
+
+            if (msg != None):
+                entry["message_id"] = msg.message_id
+                entry["file_id"] = msg.video.file_id
+                state = "uploaded"
+                self.set_journal(tableName, id, state, message_id=entry["message_id"], file_id=entry["file_id"])
+
+        if state == "metadata":
             if (yt_link == None):
                 videoFileName = self.download_video(id)
 
                 if (videoFileName == None):
-                    print("Video ID {} Download failed, skipped. ".format(id))
-                    continue
+                    logger.warning("Video ID {} Download failed, skipped. ".format(id))
+                    return False
 
                 thumbFileName = self.download_video_thumbnail(id)
 
                 if (thumbFileName == None):
-                    print("Video ID {} Thumbnail Download failed, skipped. ".format(id))
-                    continue
+                    logger.warning("Video ID {} Thumbnail Download failed, skipped. ".format(id))
+                    return False
+
+                entry["video_path"] = videoFileName
+                entry["thumb_path"] = thumbFileName
 
+            state = "downloaded"
+            self.set_journal(tableName, id, state, video_path=entry["video_path"], thumb_path=entry["thumb_path"])
+
+        # downloaded -> uploaded
+        if state == "downloaded":
+            if (yt_link == None):
                 try:
-                    msg_id = self.send_video(
-                        videoFileName, id, title, user, user_display, description, v_tags, thumbFileName)
+                    msg = self.upload_video(
+                        entry["video_path"], id, title, user, user_display, description, v_tags, entry["thumb_path"])
                 except Exception as e:
-                    print("Error in sending video: {}".format(e))
-                    continue
-            else:
+                    logger.error("Error in sending video: {}".format(e))
+                    # send_video 已删除本地文件, 下次从 metadata 重新下载
+                    self.set_journal(tableName, id, "metadata")
+                    return False
 
-                msg_id = self.send_yt_link(
+                entry["message_id"] = msg.message_id
+                entry["file_id"] = msg.video.file_id
+            else:
+                entry["message_id"] = self.send_yt_link(
                     yt_link, id, title, user, user_display, description, v_tags)
 
-            self.save_video_info(tableName, id, title,
-                                 user, user_display, msg_id)
-            user_display = video_info[2]
+            state = "uploaded"
+            self.set_journal(tableName, id, state, message_id=entry["message_id"], file_id=entry["file_id"])
+
+        # uploaded -> recorded
+        if state == "uploaded":
+            if (not self.is_video_exist(tableName, id)):
+                self.save_video_info(tableName, id, title,
+                                     user, user_display, entry["message_id"])
+            state = "recorded"
+            self.set_journal(tableName, id, state)
+
+        # recorded -> tagged
+        if state == "recorded":
             self.update_author_tags(user_display)  # 直接使用user_display更新作者集合
             # Wait for telegram to forward the video to the group
-            time.sleep(5)
+            time.sleep(self.forward_delay)
 
             self.save_authors()  # 下载完成后保存作者列表
+            state = "tagged"
+            self.set_journal(tableName, id, state)
+
+        # tagged -> described
+        if state == "tagged":
             if "chat_id_discuss" in self.config["telegram_info"]:
                 self.send_description(
                     user=user, user_display=user_display, description=description)
+            state = "described"
+            self.set_journal(tableName, id, state)
+
+        return True
+
+    def download(self, subscribed=False):
+
+        tableName = "videosNew" if subscribed == False else "videosSub"
+
+        self.init_DB(tableName)
+        self.init_journal()
+
+        if (not self.login()):
+            logger.error("Login Failed")
+            return
+
+        # 先恢复上次中断的视频, 再处理新发现的视频
+        ids = self.get_unfinished_videos(tableName)
+
+        videos = self.find_videos(subscribed=subscribed)
+
+        for video in reversed(videos):
+            if video.id not in ids:
+                ids.append(video.id)
+
+        # Download videos
+        for id in ids:
+
+            logger.info("Found video ID {}".format(id))
+
+            if self.process_video(tableName, id):
+                VIDEOS.inc(result="done")
+            else:
+                VIDEOS.inc(result="failed")
+
+    def enqueue(self, subscribed=False):
+        """# Scan for new videos and add them to the job queue
+        """
+
+        tableName = "videosNew" if subscribed == False else "videosSub"
+
+        self.init_DB(tableName)
+
+        if (not self.login()):
+            logger.error("Login Failed")
+            return
+
+        queue = JobQueue.from_config(self.config)
+
+        videos = self.find_videos(subscribed=subscribed)
+
+        # 从旧到新入队, 发布顺序与 download 一致
+        for video in reversed(videos):
+
+            id = video.id
+
+            if (self.is_video_exist(tableName, id)):
+                continue
+
+            if queue.enqueue(id, tableName):
+                logger.info("Video ID {} queued. ".format(id))
+
+        self.update_queue_depth(queue)
+        logger.info("Queue: {}".format(queue.counts()))
+
+    def update_queue_depth(self, queue):
+        for (state, n) in queue.counts().items():
+            QUEUE_DEPTH.set(n, state=state)
+
+    def process_job(self, job) -> dict:
+        """# Download a queued video and stage it in the staging chat
+        Returns the job result used by the publisher.
+        """
+
+        id = job.video_id
+
+        result = self.get_video_info(id)
+
+        if (result["yt_link"] != None):
+            return result
+
+        msg = None
+
+        if self.streaming_enabled():
+            msg = self.stream_video(id, result["title"], result["user"], result["user_display"],
+                                    result["description"], chat_id=self.config["telegram_info"]["chat_id_staging"])
+
+        if (msg == None):
+            videoFileName = self.download_video(id)
+
+            if (videoFileName == None):
+                raise Exception("Video ID {} Download failed".format(id))
+
+            thumbFileName = self.download_video_thumbnail(id)
+
+            if (thumbFileName == None):
+                os.remove(videoFileName)
+                raise Exception("Video ID {} Thumbnail Download failed".format(id))
+
+            msg = self.upload_video(videoFileName, id, result["title"], result["user"], result["user_display"],
+                                    result["description"], result["v_tags"], thumbFileName,
+                                    chat_id=self.config["telegram_info"]["chat_id_staging"])
+
+        result.update({"file_id": msg.video.file_id,
+                       "staging_message_id": msg.message_id,
+                       "caption": msg.caption_html,
+                       "width": msg.video.width,
+                       "height": msg.video.height,
+                       "duration": msg.video.duration})
+
+        return result
+
+    def work(self, worker_id=None, poll=30, once=False):
+        """# Claim jobs from the queue until it is empty
+        - worker_id: defaults to hostname-pid
+        - once: exit when no job is available instead of polling
+        """
+
+        worker_id = "{}-{}".format(socket.gethostname(), os.getpid()) if worker_id is None else worker_id
+
+        if (not self.login()):
+            logger.error("Login Failed")
+            return
+
+        queue = JobQueue.from_config(self.config)
+
+        while True:
+            job = queue.claim(worker_id)
+
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll)
+                continue
+
+            logger.info("Worker {} claimed video ID {} (attempt {})".format(worker_id, job.video_id, job.attempts))
+
+            # 处理期间定期续租, 进程退出后租约过期, 任务会被其他 worker 接手
+            stop = threading.Event()
+
+            def heartbeat():
+                while not stop.wait(queue.lease / 3):
+                    if not queue.heartbeat(job):
+                        logger.warning("Worker {} lost lease on video ID {}".format(worker_id, job.video_id))
+                        return
+
+            heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+            heartbeat_thread.start()
+
+            try:
+                result = self.process_job(job)
+            except Exception as e:
+                logger.error("Error in processing video ID {}: {}".format(job.video_id, e))
+                FAILURES.inc(stage="job", cause=failure_cause(e))
+                queue.fail(job, e)
+                self.update_queue_depth(queue)
+                continue
+            finally:
+                stop.set()
+                heartbeat_thread.join()
+                # 缓存中的 fileUrl 带有过期时间, 重试时必须重新获取; 也避免缓存无限增长
+                self.client.video_cache.pop(job.video_id, None)
+
+            if not queue.complete(job, result):
+                logger.warning("Video ID {} was taken over by another worker, dropped. ".format(job.video_id))
+
+            self.update_queue_depth(queue)
+
+    def publish(self, poll=30, once=False):
+        """# Post staged jobs to the channel in queue order
+        Only one publisher should run at a time.
+        """
+
+        queue = JobQueue.from_config(self.config)
+        chat_id = self.config["telegram_info"]["chat_id"]
+
+        while True:
+            job = queue.next_to_publish()
+
+            if job is None or job.state != READY:
+                # 队首任务尚未完成, 等待以保持顺序
+                if once:
+                    return
+                time.sleep(poll)
+                continue
+
+            id = job.video_id
+            result = job.result
+
+            if (self.is_video_exist(job.table_name, id)):
+                logger.info("Video ID {} Already sent, skipped. ".format(id))
+                queue.mark_published(job)
+                continue
+
+            msg_id = None
+
+            for attempt in range(queue.max_attempts):
+                try:
+                    msg_id = self.publish_job(job, chat_id)
+                    break
+                except Exception as e:
+                    error = e
+                    logger.error("Error in publishing video ID {}: {}".format(id, e))
+                    if attempt < queue.max_attempts - 1:
+                        RETRIES.inc(stage="publish")
+                        time.sleep(self.publish_delay * 2 ** attempt)
+
+            if msg_id == None:
+                # 放弃该任务, 以免阻塞后续视频的发布
+                FAILURES.inc(stage="publish", cause=failure_cause(error))
+                queue.mark_failed(job, error)
+                self.update_queue_depth(queue)
+                logger.warning("Video ID {} failed to publish, skipped. ".format(id))
+                continue
+
+            # 先标记已发布, 之后的步骤出错也不会重复发送
+            queue.mark_published(job)
+            self.update_queue_depth(queue)
+            logger.info("Video ID {} published. ".format(id))
+
+            try:
+                self.init_DB(job.table_name)
+                self.save_video_info(job.table_name, id, result["title"],
+                                     result["user"], result["user_display"], msg_id)
+
+                self.update_author_tags(result["user_display"])
+                # Wait for telegram to forward the video to the group
+                time.sleep(self.forward_delay)
+
+                if "chat_id_discuss" in self.config["telegram_info"]:
+                    self.send_description(
+                        user=result["user"], user_display=result["user_display"], description=result["description"])
+            except Exception as e:
+                FAILURES.inc(stage="publish", cause=failure_cause(e))
+                logger.error("Error after publishing video ID {}: {}".format(id, e))
+
+    def publish_job(self, job, chat_id) -> int:
+        """# Post a staged job to the channel and return the message ID
+        """
+        id = job.video_id
+        result = job.result
+
+        if result["yt_link"] != None:
+            return self.send_yt_link(result["yt_link"], id, result["title"], result["user"],
+                                     result["user_display"], result["description"], result["v_tags"])
+
+        try:
+            msg = self.bot.send_video(chat_id=chat_id, video=result["file_id"], supports_streaming=True,
+                                      timeout=300, width=result["width"], height=result["height"],
+                                      duration=result["duration"], caption=result["caption"], parse_mode="HTML")
+        except:
+            msg = self.bot.send_video(chat_id=chat_id, video=result["file_id"], supports_streaming=True,
+                                      timeout=300, width=result["width"], height=result["height"],
+                                      duration=result["duration"], caption=result["caption"])
+
+        try:
+            self.bot.delete_message(chat_id=self.config["telegram_info"]["chat_id_staging"],
+                                    message_id=result["staging_message_id"])
+        except Exception as e:
+            logger.warning("Error in deleting staged video: {}".format(e))
+
+        return msg.message_id
+
+    def fetch_page(self, page, subscribed, limiter) -> Iterator[Video]:
+        limiter.wait()
+        with STAGE_SECONDS.time(stage="listing"):
+            return self.client.iter_videos(sort='date', rating=self.rating, page=page, subscribed=subscribed)
+
+    def backfill(self, subscribed=False, since=None, until=None):
+        """# Populate the database from the video listing without posting
+        - since / until: only keep videos created in [since, until], datetime or None.
+          since defaults to one year ago.
+        Progress is checkpointed per page window in backfillState, so an
+        interrupted backfill continues where it stopped. The checkpoint is
+        removed once the backfill finishes.
+        """
+
+        tableName = "videosNew" if subscribed == False else "videosSub"
+        options = self.config.get("backfill", {})
+        concurrency = options.get("concurrency", 4)
+        limiter = RateLimiter(options.get("interval", 1.0))  # 所有线程共享的请求间隔
+
+        self.init_DB(tableName)
+
+        c, conn = self.connect_DB()
+        c.execute("""CREATE TABLE IF NOT EXISTS backfillState (
+            name TEXT PRIMARY KEY,
+            page INTEGER,
+            updated REAL,
+            since TEXT
+        )""")
+        c.execute("PRAGMA table_info(backfillState)")
+        if "since" not in [column[1] for column in c.fetchall()]:
+            c.execute("ALTER TABLE backfillState ADD COLUMN since TEXT")
+        self.close_DB(conn)
+
+        if (not self.login()):
+            logger.error("Login Failed")
+            return
+
+        until_date = until.strftime("%Y%m%d") if until is not None else None
+        # 默认起始日期每天都在变化, 不能作为检查点的键, 改为保存在检查点中
+        name = "{}:{}:{}:{}".format(tableName, self.rating,
+                                    since.strftime("%Y%m%d") if since is not None else "default", until_date)
+
+        c, conn = self.connect_DB()
+        c.execute("SELECT page, since FROM backfillState WHERE name = ?", (name,))
+        row = c.fetchone()
+        self.close_DB(conn)
+
+        (page, since_date) = (0, None) if row is None else row
+        if page > 0:
+            logger.info("Resuming backfill {} from page {}".format(name, page))
+
+        if since_date is None:
+            since_date = (since if since is not None else datetime.today() - relativedelta(years=1)).strftime("%Y%m%d")
+
+        total = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                pages = list(range(page, page + concurrency))
+                try:
+                    results = list(executor.map(lambda p: self.fetch_page(p, subscribed, limiter), pages))
+                except Exception as e:
+                    FAILURES.inc(stage="listing", cause=failure_cause(e))
+                    logger.error("Error in fetching pages {}-{}: {}".format(pages[0], pages[-1], e))
+                    return
+
+                rows = []
+                finished = False
+
+                for videos in results:
+                    empty = True
+
+                    for video in videos:
+                        empty = False
+                        date = video.created_at[:10].replace("-", "")
+                        if until_date is not None and date > until_date:
+                            continue
+                        if date < since_date:
+                            # 列表按日期倒序, 之后的视频都更早
+                            finished = True
+                            break
+                        (likes, views) = self.get_video_stat(video)
+                        rows.append((video.id, video.title, video.user.username,
+                                     video.user.name, int(date), views, likes))
+
+                    if finished or empty:
+                        finished = True
+                        break
+
+                page += concurrency
+
+                # 同一事务内写入视频和检查点, 中断后不会重复或遗漏
+                c, conn = self.connect_DB()
+                c.executemany("""INSERT INTO """ + tableName + """ (id, title, user, user_display, date, views, likes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET views = excluded.views, likes = excluded.likes""", rows)
+                if finished:
+                    c.execute("DELETE FROM backfillState WHERE name = ?", (name,))
+                else:
+                    c.execute("""INSERT INTO backfillState (name, page, updated, since) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (name) DO UPDATE SET page = excluded.page, updated = excluded.updated""",
+                              (name, page, time.time(), since_date))
+                self.close_DB(conn)
+
+                total += len(rows)
+                logger.info("Backfilled {} videos, next page {}".format(total, page))
+
+                if finished:
+                    break
+
+        logger.info("Backfill {} finished".format(name))
+
+    def start_metrics(self):
+        """# Serve metrics over HTTP if "metrics": {"port": ...} is configured
+        """
+        port = self.config.get("metrics", {}).get("port")
+        if port is not None:
+            REGISTRY.serve(int(port))
+            logger.info("Serving metrics on port {}".format(port))
+
+    def export_metrics(self):
+        """# Write metrics to "metrics": {"textfile": ...} for cron runs
+        """
+        textfile = self.config.get("metrics", {}).get("textfile")
+        if textfile is not None:
+            REGISTRY.write_textfile(textfile)
+            logger.debug("Metrics written to {}".format(textfile))
 
     def send_ranking(self, title, entries):
 
@@ -513,10 +1293,12 @@ by: <a href="{}/{}/">{}</a>
 """
 
         for i in range(1, len(entries)+1):
-            (title, user_display, chat_id, likes, views, heats,) = entries[i-1]
+            (title, user_display, chat_id, likes, views, heats, id,) = entries[i-1]
+            # 回填的视频未发送到频道, 链接到 iwara 页面
+            link = f"https://t.me/iwara2/{chat_id}" if chat_id is not None else f"{self.videoUrl}/{id}/"
             ranking_description += f"""
 Top {i} ❤️{likes} 🔥{views}
-<a href="https://t.me/iwara2/{chat_id}">{title}</a> by {user_display}"""
+<a href="{link}">{title}</a> by {user_display}"""
 
         try:
             self.bot.send_message(
@@ -558,13 +1340,13 @@ Top {i} ❤️{likes} 🔥{views}
 
             self.login()
 
-            print("Fetching video stats...")
+            logger.info("Fetching video stats...")
 
             self.update_stat_after(date.strftime("%Y%m%d"), tableName)
 
             c, conn = self.connect_DB()
 
-            c.execute("""SELECT title, user_display, chat_id, likes, views, likes * 20 + views as heats FROM """ +
+            c.execute("""SELECT title, user_display, chat_id, likes, views, likes * 20 + views as heats, id FROM """ +
                       tableName + " WHERE date >= ? ORDER BY heats DESC", (date.strftime("%Y%m%d"),))
             entries = c.fetchmany(10)
 
@@ -579,6 +1361,9 @@ Top {i} ❤️{likes} 🔥{views}
 if __name__ == '__main__':
     args = sys.argv
 
+    logging.basicConfig(level=os.environ.get("IWARA_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
     def usage():
         print("""
 Usage: python {} <mode> <option>
@@ -589,11 +1374,15 @@ option can be:
 \t dlsub: download the latest page of your subscription list
 \t dlnew: download the latest page of the new videos
 \t rank -d/-w/-m/-y: send daily/weekly/monthly/annually ranking of your database
+\t enqueue sub/new: add the latest videos of your subscription list / new videos to the job queue
+\t worker: download queued videos and upload them to the staging chat
+\t publish: post staged videos to the channel in queue order
+\t backfill [since] [until] [sub]: add videos created between the YYYY-MM-DD dates (default: one year ago until today) to your database without posting
 
         """.format(args[0]))
         exit(1)
 
-    if (len(args) < 2 or len(args) > 4):
+    if (len(args) < 2 or len(args) > 6):
         usage()
 
     if (args[1] == "-n" or args[1] == "normal"):
@@ -603,20 +1392,49 @@ option can be:
     else:
         usage()
 
-    if (args[2] == "dlsub"):
-        bot.download(subscribed=True)
-    elif (args[2] == "dlnew"):
-        bot.download()
-    elif (args[2] == "rank"):
-        if (args[3] == "-d"):
-            bot.ranking("DAILY")
-        elif (args[3] == "-w"):
-            bot.ranking("WEEKLY")
-        elif (args[3] == "-m"):
-            bot.ranking("MONTHLY")
-        elif (args[3] == "-y"):
-            bot.ranking("YEARLY")
+    bot.start_metrics()
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: bot.reload_bandwidth())
+
+    try:
+        if (args[2] == "dlsub"):
+            bot.download(subscribed=True)
+        elif (args[2] == "dlnew"):
+            bot.download()
+        elif (args[2] == "enqueue"):
+            if (len(args) > 3 and args[3] == "sub"):
+                bot.enqueue(subscribed=True)
+            else:
+                bot.enqueue()
+        elif (args[2] == "worker"):
+            bot.work()
+        elif (args[2] == "publish"):
+            bot.publish()
+        elif (args[2] == "backfill"):
+            options = args[3:]
+            subscribed = "sub" in options
+            try:
+                dates = [datetime.strptime(option, "%Y-%m-%d") for option in options if option != "sub"]
+            except ValueError:
+                usage()
+            if len(dates) > 2:
+                usage()
+            since = dates[0] if len(dates) > 0 else None
+            until = dates[1] if len(dates) > 1 else None
+            bot.backfill(subscribed=subscribed, since=since, until=until)
+        elif (args[2] == "rank"):
+            if (args[3] == "-d"):
+                bot.ranking("DAILY")
+            elif (args[3] == "-w"):
+                bot.ranking("WEEKLY")
+            elif (args[3] == "-m"):
+                bot.ranking("MONTHLY")
+            elif (args[3] == "-y"):
+                bot.ranking("YEARLY")
+            else:
+                usage()
         else:
             usage()
-    else:
-        usage()
+    finally:
+        bot.export_metrics()
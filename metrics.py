@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+# Histogram buckets in seconds, from metadata calls up to multi-GB transfers
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _format_labels(labelnames, labelvalues, extra=()) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for (k, v) in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """# Base class of labelled metrics
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} expects labels {}, got {}".format(self.name, self.labelnames, tuple(labels)))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for (name, labels, value) in self.samples():
+            lines.append("{}{} {}".format(name, labels, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for (key, value) in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for (key, value) in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            (counts, _, _) = entry = self.values[key]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """# Observe the duration of a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_sum(self, **labels) -> float:
+        entry = self.values.get(self._key(labels))
+        return entry[1] if entry else 0.0
+
+    def get_count(self, **labels) -> int:
+        entry = self.values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for (key, (counts, total, count)) in sorted(self.values.items()):
+                cumulative = 0
+                for (bound, n) in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append((self.name + "_bucket",
+                                    _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))]),
+                                    cumulative))
+                samples.append((self.name + "_sum", _format_labels(self.labelnames, key), total))
+                samples.append((self.name + "_count", _format_labels(self.labelnames, key), count))
+        return samples
+
+
+class Registry:
+    """# Collection of metrics rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics.values())
+
+    def write_textfile(self, path):
+        """# Write metrics for the node_exporter textfile collector
+        Written atomically so the collector never reads a partial file.
+        """
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, addr="") -> ThreadingHTTPServer:
+        """# Serve /metrics from a background thread
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+
+# Stages: listing, metadata, download, faststart, probe, upload,
+# stream (download piped into upload), db. FAILURES and RETRIES also use
+# thumbnail, job (a whole queue job) and publish.
+STAGE_SECONDS = REGISTRY.histogram(
+    "iwara_stage_seconds", "Time spent per pipeline stage", ["stage"])
+TRANSFER_BYTES = REGISTRY.counter(
+    "iwara_transfer_bytes_total", "Bytes transferred", ["direction"])
+TRANSFER_RATE = REGISTRY.gauge(
+    "iwara_transfer_bytes_per_second", "Throughput of the last transfer", ["direction"])
+RATE_LIMIT_WAIT = REGISTRY.counter(
+    "iwara_rate_limit_wait_seconds_total", "Time spent sleeping between iwara API requests")
+BANDWIDTH_WAIT = REGISTRY.counter(
+    "iwara_bandwidth_wait_seconds_total", "Time bulk transfers waited for bandwidth budget", ["direction"])
+RETRIES = REGISTRY.counter(
+    "iwara_retries_total", "Retried operations", ["stage"])
+FAILURES = REGISTRY.counter(
+    "iwara_failures_total", "Failed operations by cause", ["stage", "cause"])
+QUEUE_DEPTH = REGISTRY.gauge(
+    "iwara_queue_jobs", "Jobs in the job queue", ["state"])
+VIDEOS = REGISTRY.counter(
+    "iwara_videos_total", "Videos processed by result", ["result"])
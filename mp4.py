@@ -0,0 +1,230 @@
+import os
+import struct
+from typing import Iterator, Optional, Tuple
+
+# Atoms that only contain other atoms, on the way from moov to stco/co64
+CONTAINER_ATOMS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+# moov is held in memory while it is patched
+MAX_MOOV_SIZE = 256 * 1024 * 1024
+
+
+class Mp4Error(Exception):
+    pass
+
+
+def read_atoms(f, start=0, end=None) -> Iterator[Tuple[bytes, int, int, int]]:
+    """# Iterate top-level atoms of an open file
+    Yields (type, offset, size, header_size).
+    """
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        (size, atom_type) = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header_size or pos + size > end:
+            raise Mp4Error("Invalid atom {} at offset {}".format(atom_type, pos))
+
+        yield (atom_type, pos, size, header_size)
+        pos += size
+
+
+def _patch_chunk_offsets(moov, start, end, shift_from, shift_to, delta):
+    """# Add delta to every stco/co64 entry pointing into [shift_from, shift_to)
+    """
+    pos = start
+    while pos + 8 <= end:
+        (size, atom_type) = struct.unpack_from(">I4s", moov, pos)
+        header_size = 8
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", moov, pos + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header_size or pos + size > end:
+            raise Mp4Error("Invalid atom {} in moov".format(atom_type))
+
+        if atom_type in CONTAINER_ATOMS:
+            _patch_chunk_offsets(moov, pos + header_size, pos + size, shift_from, shift_to, delta)
+        elif atom_type in (b"stco", b"co64"):
+            # version/flags(4) + entry_count(4)
+            (count,) = struct.unpack_from(">I", moov, pos + header_size + 4)
+            entry_format = ">I" if atom_type == b"stco" else ">Q"
+            entry_size = struct.calcsize(entry_format)
+            entry = pos + header_size + 8
+
+            if entry + count * entry_size > pos + size:
+                raise Mp4Error("Truncated {} atom".format(atom_type))
+
+            for _ in range(count):
+                (offset,) = struct.unpack_from(entry_format, moov, entry)
+                if shift_from <= offset < shift_to:
+                    offset += delta
+                    if atom_type == b"stco" and offset > 0xFFFFFFFF:
+                        raise Mp4Error("Chunk offset overflows stco")
+                    struct.pack_into(entry_format, moov, entry, offset)
+                entry += entry_size
+
+        pos += size
+
+
+def _copy(src, dst, start, length, buffer_size):
+    src.seek(start)
+    while length > 0:
+        chunk = src.read(min(buffer_size, length))
+        if not chunk:
+            raise Mp4Error("Unexpected end of file")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def faststart(path, buffer_size=1024 * 1024) -> bool:
+    """# Move moov in front of mdat so playback can start before the download ends
+    Rewrites the file in one sequential pass, holding only moov and one copy
+    buffer in memory. Returns False if the file is already faststart or is
+    not a plain (non-fragmented) MP4.
+    """
+    with open(path, "rb") as src:
+        atoms = list(read_atoms(src))
+        types = [atom[0] for atom in atoms]
+
+        if b"moov" not in types or b"mdat" not in types or b"moof" in types:
+            return False
+
+        (_, moov_pos, moov_size, _) = atoms[types.index(b"moov")]
+        (_, mdat_pos, _, _) = atoms[types.index(b"mdat")]
+        file_size = atoms[-1][1] + atoms[-1][2]
+
+        if moov_pos < mdat_pos:
+            return False
+
+        if moov_size > MAX_MOOV_SIZE:
+            raise Mp4Error("moov atom too large: {} bytes".format(moov_size))
+
+        src.seek(moov_pos)
+        moov = bytearray(src.read(moov_size))
+
+        # moov 插入到第一个 mdat 之前, 中间的数据整体后移 moov_size
+        _patch_chunk_offsets(moov, 0, moov_size, mdat_pos, moov_pos, moov_size)
+
+        tmp_path = path + ".faststart"
+        try:
+            with open(tmp_path, "wb") as dst:
+                _copy(src, dst, 0, mdat_pos, buffer_size)
+                dst.write(moov)
+                _copy(src, dst, mdat_pos, moov_pos - mdat_pos, buffer_size)
+                _copy(src, dst, moov_pos + moov_size, file_size - moov_pos - moov_size, buffer_size)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    os.replace(tmp_path, path)
+    return True
+
+
+def _child_atoms(data, start, end) -> Iterator[Tuple[bytes, int, int, int]]:
+    pos = start
+    while pos + 8 <= end:
+        (size, atom_type) = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, pos + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header_size or pos + size > end:
+            raise Mp4Error("Invalid atom {}".format(atom_type))
+
+        yield (atom_type, pos, size, header_size)
+        pos += size
+
+
+def locate_moov(head) -> Optional[Tuple[int, int]]:
+    """# Find moov in the first bytes of a file
+    Returns (offset, size) if moov comes before mdat, which may extend past
+    the end of head, or None if the file is not faststart or head is too
+    short to tell.
+    """
+    pos = 0
+    while pos + 16 <= len(head):
+        (size, atom_type) = struct.unpack_from(">I4s", head, pos)
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", head, pos + 8)
+        elif size == 0:
+            return None
+
+        if size < 8:
+            raise Mp4Error("Invalid atom {} at offset {}".format(atom_type, pos))
+
+        if atom_type == b"moov":
+            return (pos, size)
+        if atom_type in (b"mdat", b"moof"):
+            return None
+
+        pos += size
+
+    return None
+
+
+def probe_moov(moov) -> dict:
+    """# Read duration and video size from a moov atom
+    Returns {"width", "height", "duration"} with duration in seconds.
+    """
+    (_, _, moov_size, header_size) = next(_child_atoms(moov, 0, len(moov)))
+
+    info = {"width": 0, "height": 0, "duration": 0.0}
+
+    for (atom_type, pos, size, child_header) in _child_atoms(moov, header_size, moov_size):
+        body = pos + child_header
+
+        if atom_type == b"mvhd":
+            version = moov[body]
+            if version == 1:
+                (timescale, duration) = struct.unpack_from(">IQ", moov, body + 20)
+            else:
+                (timescale, duration) = struct.unpack_from(">II", moov, body + 12)
+            if timescale:
+                info["duration"] = duration / timescale
+
+        elif atom_type == b"trak":
+            (width, height, handler) = _probe_trak(moov, body, pos + size)
+            if handler == b"vide" and width and height:
+                info["width"] = width
+                info["height"] = height
+
+    return info
+
+
+def _probe_trak(data, start, end) -> Tuple[int, int, Optional[bytes]]:
+    width = height = 0
+    handler = None
+
+    for (atom_type, pos, size, header_size) in _child_atoms(data, start, end):
+        if atom_type == b"tkhd":
+            # width / height are 16.16 fixed point at the end of tkhd
+            (width, height) = struct.unpack_from(">II", data, pos + size - 8)
+            width >>= 16
+            height >>= 16
+        elif atom_type == b"mdia":
+            for (child_type, child_pos, _, child_header) in _child_atoms(data, pos + header_size, pos + size):
+                if child_type == b"hdlr":
+                    # version/flags(4) + pre_defined(4) + handler_type(4)
+                    handler = bytes(data[child_pos + child_header + 8:child_pos + child_header + 12])
+
+    return (width, height, handler)
@@ -0,0 +1,168 @@
+import threading
+import uuid
+
+import requests
+
+
+class TelegramUploadError(Exception):
+    pass
+
+
+class MultipartStream:
+    """# multipart/form-data body produced while it is being sent
+
+    File parts are read from their file objects in small pieces as the HTTP
+    client asks for them, so memory use does not depend on the file size and
+    every piece can be paced by a bandwidth governor.
+
+    - fields: {name: value}, None values are skipped
+    - files: [(name, filename, fileobj, size)]
+    """
+
+    def __init__(self, fields, files, governor=None):
+        self.boundary = uuid.uuid4().hex
+        self.governor = governor
+        self.segments = []
+
+        for (name, value) in fields.items():
+            if value is None:
+                continue
+            self.segments.append((
+                "--{}\r\nContent-Disposition: form-data; name=\"{}\"\r\n\r\n{}\r\n"
+                .format(self.boundary, name, value)).encode("utf-8"))
+
+        for (name, filename, f, size) in files:
+            self.segments.append((
+                "--{}\r\nContent-Disposition: form-data; name=\"{}\"; filename=\"{}\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n"
+                .format(self.boundary, name, filename)).encode("utf-8"))
+            self.segments.append((f, size))
+            self.segments.append(b"\r\n")
+
+        self.segments.append("--{}--\r\n".format(self.boundary).encode("utf-8"))
+
+        self.length = sum(len(segment) if isinstance(segment, bytes) else segment[1] for segment in self.segments)
+        self.index = 0
+        self.offset = 0
+
+    @property
+    def content_type(self) -> str:
+        return "multipart/form-data; boundary=" + self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def read(self, n=-1) -> bytes:
+        out = bytearray()
+
+        while self.index < len(self.segments) and (n < 0 or len(out) < n):
+            segment = self.segments[self.index]
+            want = None if n < 0 else n - len(out)
+
+            if isinstance(segment, bytes):
+                end = len(segment) if want is None else self.offset + want
+                chunk = segment[self.offset:end]
+                size = len(segment)
+            else:
+                (f, size) = segment
+                remaining = size - self.offset
+                chunk = f.read(remaining if want is None else min(want, remaining))
+                if not chunk:
+                    raise TelegramUploadError("File ended {} bytes early".format(remaining))
+                if self.governor is not None:
+                    self.governor.throttle("upload", len(chunk))
+
+            out += chunk
+            self.offset += len(chunk)
+
+            if self.offset >= size:
+                self.index += 1
+                self.offset = 0
+
+        return bytes(out)
+
+
+class RingBuffer:
+    """# Fixed-size byte buffer between a producer thread and a reader
+
+    write() blocks while the buffer is full and read() blocks while it is
+    empty, so a download and an upload can run at their own pace with at
+    most `capacity` bytes in memory.
+    """
+
+    def __init__(self, capacity=16 * 1024 * 1024):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.start = 0   # 下一个读取位置
+        self.size = 0    # 缓冲区中的字节数
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            with self.cond:
+                while self.size == self.capacity and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    raise TelegramUploadError("Ring buffer closed by reader")
+
+                end = (self.start + self.size) % self.capacity
+                n = min(len(view), self.capacity - self.size, self.capacity - end)
+                self.buffer[end:end + n] = view[:n]
+                self.size += n
+                view = view[n:]
+                self.cond.notify_all()
+
+    def finish(self, error=None):
+        """# Called by the producer when there is no more data
+        """
+        with self.cond:
+            self.closed = True
+            self.error = error
+            self.cond.notify_all()
+
+    def read(self, n=-1) -> bytes:
+        with self.cond:
+            while self.size == 0 and not self.closed:
+                self.cond.wait()
+            if self.size == 0 and self.error is not None:
+                raise TelegramUploadError("Source stream failed: {}".format(self.error))
+
+            n = self.size if n < 0 else min(n, self.size)
+            n = min(n, self.capacity - self.start)
+            data = bytes(self.buffer[self.start:self.start + n])
+            self.start = (self.start + n) % self.capacity
+            self.size -= n
+            self.cond.notify_all()
+
+            return data
+
+    def close(self):
+        """# Called by the reader to stop the producer
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+def send_video(base_url, fields, files, governor=None, timeout=300) -> dict:
+    """# Call sendVideo with a streamed multipart body
+    - base_url: Bot API url including the token, as in telegram.Bot.base_url
+    Returns the Message of the result as a dict.
+    """
+    body = MultipartStream(fields, files, governor)
+
+    r = requests.post(base_url + "/sendVideo", data=body,
+                      headers={"Content-Type": body.content_type}, timeout=timeout)
+
+    try:
+        result = r.json()
+    except ValueError:
+        raise TelegramUploadError("Invalid response from Bot API server: HTTP {}".format(r.status_code))
+
+    if not result.get("ok"):
+        raise TelegramUploadError(result.get("description", "Unknown error"))
+
+    return result["result"]